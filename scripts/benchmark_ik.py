@@ -0,0 +1,201 @@
+#! /usr/bin/env python3
+
+'''
+Offline throughput benchmark for RelaxedIKRust. Needs no ROS master. The
+settings file is loaded the same way the RelaxedIK node loads it, and
+reproducible goal streams are run through solve_position, solve_velocity and
+hiro_solve_velocity:
+
+    random: reachable poses from Robot.fk_batch on configurations sampled within the joint limits
+    square: the square path traced by line_tracing.py
+    ramp:   linear velocities ramping out and back along x
+
+Velocity goals are treated as per-solve end-effector displacements, so the
+convergence error of a velocity stream is measured against the integrated
+target. Results can be saved as JSON, tagged with the current git commit.
+
+Usage: benchmark_ik.py [--settings SETTINGS_FILE] [--output RESULTS.json]
+'''
+
+import argparse
+import json
+import numpy as np
+import os
+import rospkg
+import subprocess
+import sys
+import time
+import yaml
+
+from goal_buffers import GoalBuffers
+from quality_monitor import articulated_limits, pose_errors
+from robot import Robot
+from solver_buffers import SolverBuffers
+from trajectories import square_path, velocity_ramp
+
+path_to_pkg = rospkg.RosPack().get_path('relaxed_ik_ros1')
+path_to_src = path_to_pkg + '/relaxed_ik_core'
+sys.path.insert(1, path_to_src + '/wrappers')
+import python_wrapper
+from python_wrapper import RelaxedIKRust
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=path_to_pkg,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def summarize(latencies, position_errors, rotation_errors=None):
+    ms = np.array(latencies) * 1000.0
+    result = {
+        'num_solves': len(ms),
+        'solves_per_sec': len(ms) / np.sum(latencies) if np.sum(latencies) > 0 else 0.0,
+        'latency_ms': {'mean': ms.mean(), 'p50': np.percentile(ms, 50), 'p90': np.percentile(ms, 90),
+                       'p99': np.percentile(ms, 99), 'max': ms.max()},
+        'position_error_m': {'mean': np.mean(position_errors), 'max': np.max(position_errors)},
+    }
+    if rotation_errors is not None:
+        result['rotation_error_rad'] = {'mean': np.mean(rotation_errors), 'max': np.max(rotation_errors)}
+    return json.loads(json.dumps(result, default=float))
+
+class Benchmark:
+    def __init__(self, setting_file_path, seed=0):
+        os.chdir(path_to_src)
+
+        setting_file = open(setting_file_path, 'r')
+        settings = yaml.load(setting_file, Loader=yaml.FullLoader)
+
+        self.robot = Robot(setting_file_path)
+        num_joints = len(self.robot.articulated_joint_names)
+        self.starting_config = np.array(settings.get('starting_config', [0.0] * num_joints), dtype=float)
+
+        self.relaxed_ik = RelaxedIKRust(setting_file_path)
+        self.solver = SolverBuffers(self.relaxed_ik, num_joints, getattr(python_wrapper, 'lib', None))
+        self.buffers = GoalBuffers(self.robot.num_chain)
+        self.buffers.tolerances[:] = 0.0
+        self.rng = np.random.default_rng(seed)
+
+        start = self.robot.fk_array(self.starting_config)
+        self.start_positions, self.start_orientations = start[:, :3], start[:, 3:]
+
+    def random_pose_goals(self, n):
+        lower, upper = articulated_limits(self.robot)
+        configs = self.rng.uniform(lower, upper, size=(n, len(lower)))
+        goals = self.robot.fk_batch(configs)
+        return goals[:, :, :3], goals[:, :, 3:]
+
+    def square_pose_goals(self):
+        positions = square_path(self.start_positions)
+        orientations = np.repeat(self.start_orientations[None, :, :], len(positions), axis=0)
+        return positions, orientations
+
+    def run_position(self, positions, orientations, repeats=1):
+        self.solver.reset(self.starting_config)
+        b = self.buffers
+        latencies = []
+        position_errors = []
+        rotation_errors = []
+        for k in range(len(positions)):
+            b.positions[:] = positions[k].ravel()
+            b.orientations[:] = orientations[k].ravel()
+            for _ in range(repeats):
+                start = time.perf_counter()
+                ik_solution = self.solver.solve_position(b)
+                latencies.append(time.perf_counter() - start)
+            position_error, rotation_error = pose_errors(self.robot, ik_solution, positions[k], orientations[k])
+            position_errors.extend(position_error)
+            rotation_errors.extend(rotation_error)
+        return summarize(latencies, position_errors, rotation_errors)
+
+    def run_velocity(self, linear_vels):
+        self.solver.reset(self.starting_config)
+        b = self.buffers
+        b.angular_vels[:] = 0.0
+        target = self.start_positions.copy()
+        latencies = []
+        position_errors = []
+        for k in range(len(linear_vels)):
+            b.linear_vels[:] = linear_vels[k].ravel()
+            target += linear_vels[k]
+            start = time.perf_counter()
+            ik_solution = self.solver.solve_velocity(b)
+            latencies.append(time.perf_counter() - start)
+            position_error, _ = pose_errors(self.robot, ik_solution, target, self.start_orientations)
+            position_errors.extend(position_error)
+        return summarize(latencies, position_errors)
+
+    def run_hiro_velocity(self, linear_vels, history_capacity=50):
+        # hiro_solve_velocity drives the first chain only
+        self.solver.reset(self.starting_config)
+        x, y, z, w = self.start_orientations[0]
+        quat_goal = [w, x, y, z]
+        x_a = self.start_positions[0]
+        x_g = x_a + np.array([0.1, 0.0, 0.0])
+        quat_line = [1.0, 0.0, 0.0]
+        cone_params = [0.05, 0.1, 0.0, 0.0]
+        tolerances = np.zeros(6)
+
+        target = x_a.copy()
+        history = [target.copy()]
+        latencies = []
+        position_errors = []
+        for k in range(len(linear_vels)):
+            target += linear_vels[k][0]
+            h = np.array(history[-history_capacity:])
+            start = time.perf_counter()
+            ik_solution = self.solver.hiro_solve_velocity(linear_vels[k][0], quat_goal, tolerances, quat_line,
+                                                          cone_params, x_a, x_g, h[:, 0], h[:, 1], h[:, 2])
+            latencies.append(time.perf_counter() - start)
+            fk_position = self.robot.fk_array(ik_solution)[0, :3]
+            position_errors.append(np.linalg.norm(fk_position - target))
+            history.append(fk_position)
+        return summarize(latencies, position_errors)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark RelaxedIKRust without ROS.')
+    parser.add_argument('--settings', default=path_to_src + '/configs/settings.yaml', help='settings file to load')
+    parser.add_argument('--num_random', type=int, default=500, help='number of random pose goals')
+    parser.add_argument('--repeats', type=int, default=1, help='solves per random pose goal')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the random goal stream')
+    parser.add_argument('--output', default='', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    setting_file_path = os.path.abspath(args.settings)
+    output_path = os.path.abspath(args.output) if args.output != '' else ''
+
+    benchmark = Benchmark(setting_file_path, args.seed)
+    ramp = velocity_ramp(benchmark.robot.num_chain)
+    results = {
+        'solve_position': {
+            'random': benchmark.run_position(*benchmark.random_pose_goals(args.num_random), repeats=args.repeats),
+            'square': benchmark.run_position(*benchmark.square_pose_goals()),
+        },
+        'solve_velocity': {
+            'ramp': benchmark.run_velocity(ramp),
+        },
+        'hiro_solve_velocity': {
+            'ramp': benchmark.run_hiro_velocity(ramp),
+        },
+    }
+
+    report = {
+        'commit': git_commit(),
+        'settings': setting_file_path,
+        'seed': args.seed,
+        'num_random': args.num_random,
+        'repeats': args.repeats,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+    for method, streams in results.items():
+        for stream, r in streams.items():
+            print("{:>20} {:>7}: {:8.1f} solves/s, p50 {:.3f} ms, p99 {:.3f} ms, mean position error {:.2e} m".format(
+                  method, stream, r['solves_per_sec'], r['latency_ms']['p50'], r['latency_ms']['p99'],
+                  r['position_error_m']['mean']))
+
+    if output_path != '':
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print("Results written to {}".format(output_path))
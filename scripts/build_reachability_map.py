@@ -0,0 +1,50 @@
+#! /usr/bin/env python3
+
+'''
+Builds the reachability map of the robot in a settings file. Needs no ROS
+master. Configurations are sampled uniformly within the joint limits, their
+end-effector poses computed with Robot.fk_batch, and the voxels each chain's
+tip reached, with the approach directions seen in each, are written to a
+compressed .npz file that ReachabilityMap loads.
+
+Usage: build_reachability_map.py [--settings SETTINGS_FILE] [--output MAP.npz]
+'''
+
+import argparse
+import numpy as np
+import os
+import rospkg
+import time
+
+from reachability import build_reachability_map
+from robot import Robot
+
+path_to_src = rospkg.RosPack().get_path('relaxed_ik_ros1') + '/relaxed_ik_core'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build a voxelized reachability map for the configured robot.')
+    parser.add_argument('--settings', default=path_to_src + '/configs/settings.yaml', help='settings file to load')
+    parser.add_argument('--output', default='reachability.npz', help='map file to write')
+    parser.add_argument('--num_samples', type=int, default=1000000, help='number of joint configurations to sample')
+    parser.add_argument('--voxel_size', type=float, default=0.05, help='voxel edge length (m)')
+    parser.add_argument('--num_directions', type=int, default=64, help='approach direction bins per voxel (at most 64)')
+    parser.add_argument('--batch_size', type=int, default=10000, help='configurations per FK batch')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the configuration sampler')
+    args = parser.parse_args()
+
+    setting_file_path = os.path.abspath(args.settings)
+    output_path = os.path.abspath(args.output)
+
+    robot = Robot(setting_file_path)
+
+    t_start = time.time()
+    data = build_reachability_map(robot, args.num_samples, args.voxel_size, args.batch_size,
+                                  args.num_directions, np.random.default_rng(args.seed))
+    elapsed = time.time() - t_start
+
+    np.savez_compressed(output_path, **data)
+    for i in range(robot.num_chain):
+        grid = data['masks_{}'.format(i)]
+        print("chain {}: {} of {} voxels reachable, origin {}".format(
+              i, np.count_nonzero(grid), grid.size, data['origin_{}'.format(i)] * args.voxel_size))
+    print("{} samples in {:.1f} s, map written to {}".format(args.num_samples, elapsed, output_path))
@@ -0,0 +1,120 @@
+#! /usr/bin/env python3
+
+import numpy as np
+
+class GoalBuffers:
+    """
+    Preallocated NumPy buffers for the flat goal arrays RelaxedIKRust expects.
+    The flat arrays are reused across calls; the per-chain views are filled in
+    place straight from the geometry_msgs fields of the incoming messages.
+    """
+    def __init__(self, num_chain):
+        self.resize(num_chain)
+
+    def resize(self, num_chain):
+        self.num_chain = num_chain
+
+        self.positions = np.zeros(3 * num_chain)
+        self.orientations = np.zeros(4 * num_chain)
+        self.linear_vels = np.zeros(3 * num_chain)
+        self.angular_vels = np.zeros(3 * num_chain)
+        self.tolerances = np.zeros(6 * num_chain)
+
+        self.position_rows = self.positions.reshape((num_chain, 3))
+        self.orientation_rows = self.orientations.reshape((num_chain, 4))
+        self.linear_vel_rows = self.linear_vels.reshape((num_chain, 3))
+        self.angular_vel_rows = self.angular_vels.reshape((num_chain, 3))
+        self.tolerance_rows = self.tolerances.reshape((num_chain, 6))
+
+        # ctypes views sharing memory with the flat arrays, for direct FFI calls
+        self.positions_c = np.ctypeslib.as_ctypes(self.positions)
+        self.orientations_c = np.ctypeslib.as_ctypes(self.orientations)
+        self.linear_vels_c = np.ctypeslib.as_ctypes(self.linear_vels)
+        self.angular_vels_c = np.ctypeslib.as_ctypes(self.angular_vels)
+        self.tolerances_c = np.ctypeslib.as_ctypes(self.tolerances)
+
+    def pack_poses(self, ee_poses, tolerances):
+        if len(ee_poses) != self.num_chain:
+            self.resize(len(ee_poses))
+
+        for i, pose in enumerate(ee_poses):
+            p = pose.position
+            o = pose.orientation
+            self.position_rows[i] = (p.x, p.y, p.z)
+            self.orientation_rows[i] = (o.x, o.y, o.z, o.w)
+        self.pack_tolerances(tolerances)
+
+        return self.positions, self.orientations, self.tolerances
+
+    def pack_pose_update(self, chain_indices, ee_poses, tolerances):
+        # Overwrite only the listed chains; empty tolerances keep the current ones
+        assert len(chain_indices) == len(ee_poses), "Expected one pose per chain index"
+        assert len(tolerances) in (0, len(chain_indices)), "Expected no tolerances or one per chain index"
+
+        for k, i in enumerate(chain_indices):
+            p = ee_poses[k].position
+            o = ee_poses[k].orientation
+            self.position_rows[i] = (p.x, p.y, p.z)
+            self.orientation_rows[i] = (o.x, o.y, o.z, o.w)
+            if len(tolerances) > 0:
+                l = tolerances[k].linear
+                a = tolerances[k].angular
+                self.tolerance_rows[i] = (l.x, l.y, l.z, a.x, a.y, a.z)
+
+        return self.positions, self.orientations, self.tolerances
+
+    def copy_poses_from(self, other):
+        if other.num_chain != self.num_chain:
+            self.resize(other.num_chain)
+        self.positions[:] = other.positions
+        self.orientations[:] = other.orientations
+        self.tolerances[:] = other.tolerances
+
+    def pack_twists(self, ee_vels, tolerances):
+        if len(ee_vels) != self.num_chain:
+            self.resize(len(ee_vels))
+
+        for i, twist in enumerate(ee_vels):
+            l = twist.linear
+            a = twist.angular
+            self.linear_vel_rows[i] = (l.x, l.y, l.z)
+            self.angular_vel_rows[i] = (a.x, a.y, a.z)
+        self.pack_tolerances(tolerances)
+
+        return self.linear_vels, self.angular_vels, self.tolerances
+
+    def pack_tolerances(self, tolerances):
+        # Chains without an explicit tolerance default to zero tolerance
+        n = min(len(tolerances), self.num_chain)
+        for i in range(n):
+            l = tolerances[i].linear
+            a = tolerances[i].angular
+            self.tolerance_rows[i] = (l.x, l.y, l.z, a.x, a.y, a.z)
+        self.tolerance_rows[n:] = 0.0
+
+def pack_pose_batch(goals, num_chain):
+    # One row per goal set, laid out exactly like the single-goal buffers. Allocates its own
+    # arrays, so unlike the GoalBuffers methods it is safe to call from any thread.
+    n = len(goals)
+    if n > 0:
+        num_chain = len(goals[0].ee_poses)
+    positions = np.zeros((n, num_chain, 3))
+    orientations = np.zeros((n, num_chain, 4))
+    tolerances = np.zeros((n, num_chain, 6))
+
+    for k, goal in enumerate(goals):
+        assert len(goal.ee_poses) == num_chain, \
+                "Every goal in a batch should have the same number of end-effector poses"
+        for i, pose in enumerate(goal.ee_poses):
+            p = pose.position
+            o = pose.orientation
+            positions[k, i] = (p.x, p.y, p.z)
+            orientations[k, i] = (o.x, o.y, o.z, o.w)
+        for i in range(min(len(goal.tolerances), num_chain)):
+            l = goal.tolerances[i].linear
+            a = goal.tolerances[i].angular
+            tolerances[k, i] = (l.x, l.y, l.z, a.x, a.y, a.z)
+
+    return (positions.reshape((n, 3 * num_chain)),
+            orientations.reshape((n, 4 * num_chain)),
+            tolerances.reshape((n, 6 * num_chain)))
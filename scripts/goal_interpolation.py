@@ -0,0 +1,142 @@
+#! /usr/bin/env python3
+
+import numpy as np
+import threading
+
+from goal_buffers import GoalBuffers
+
+def slerp(q0, q1, alpha):
+    # Row-wise slerp between (n, 4) quaternion arrays; alpha > 1 extrapolates
+    dot = np.sum(q0 * q1, axis=1)
+    q1 = np.where((dot < 0.0)[:, None], -q1, q1)
+    dot = np.clip(np.abs(dot), -1.0, 1.0)
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+
+    small = sin_theta < 1e-6
+    safe_sin = np.where(small, 1.0, sin_theta)
+    w0 = np.where(small, 1.0 - alpha, np.sin((1.0 - alpha) * theta) / safe_sin)
+    w1 = np.where(small, alpha, np.sin(alpha * theta) / safe_sin)
+
+    q = w0[:, None] * q0 + w1[:, None] * q1
+    return q / np.linalg.norm(q, axis=1)[:, None]
+
+class PoseGoalInterpolator:
+    """
+    Keeps the two most recent pose goals and samples them at arbitrary times.
+    Sampling at (t - delay) interpolates between them; sampling past the newest
+    goal briefly extrapolates along the last motion and then eases back onto the
+    newest goal, with a time constant of at most max_extrapolation seconds or a
+    quarter of the input period. With delay None the delay follows the observed
+    input period, so samples interpolate rather than extrapolate.
+    """
+    # Cap on the extrapolation time constant, in observed input periods
+    EXTRAPOLATION_PERIODS = 0.25
+
+    def __init__(self, num_chain, delay=None, max_extrapolation=0.05, nominal_period=0.01):
+        self.delay = delay
+        self.max_extrapolation = max_extrapolation
+        self.period = nominal_period
+        self.input_buffers = GoalBuffers(num_chain)
+        self.goals = []
+        self.lock = threading.Lock()
+
+    def add(self, ee_poses, tolerances, stamp):
+        with self.lock:
+            self.input_buffers.pack_poses(ee_poses, tolerances)
+            self.push(self.input_buffers, stamp)
+
+    def add_buffers(self, b, stamp):
+        # Same as add, for a goal already packed into GoalBuffers
+        with self.lock:
+            self.push(b, stamp)
+
+    def push(self, b, stamp):
+        goal = (stamp, b.position_rows.copy(), b.orientation_rows.copy(), b.tolerances.copy())
+        if len(self.goals) > 0 and self.goals[-1][1].shape != goal[1].shape:
+            self.goals = []
+        if len(self.goals) > 0 and stamp > self.goals[-1][0]:
+            # Smooth the period estimate against input jitter
+            self.period = 0.9 * self.period + 0.1 * (stamp - self.goals[-1][0])
+        self.goals = self.goals[-1:] + [goal]
+
+    def sample(self, t, buffers):
+        """Write the goal at time t into buffers. Returns False until a goal has arrived."""
+        with self.lock:
+            if len(self.goals) == 0:
+                return False
+
+            t1, p1, q1, tol = self.goals[-1]
+            if buffers.num_chain != len(p1):
+                buffers.resize(len(p1))
+
+            if len(self.goals) == 1 or t1 <= self.goals[0][0]:
+                buffers.position_rows[:] = p1
+                buffers.orientation_rows[:] = q1
+            else:
+                t0, p0, q0, _ = self.goals[0]
+                delay = self.period if self.delay is None else self.delay
+                alpha = max((t - delay - t0) / (t1 - t0), 0.0)
+                if alpha > 1.0:
+                    # e * exp(-e / tau) leaves the newest goal at the last motion's speed, peaks at
+                    # tau / e seconds' worth of that motion and decays back to zero, so a late or
+                    # stopped input never makes the goal jump or stay past the newest one
+                    e = t - delay - t1
+                    tau = min(self.max_extrapolation, self.EXTRAPOLATION_PERIODS * self.period)
+                    alpha = 1.0 + e * np.exp(-e / tau) / (t1 - t0) if tau > 0.0 else 1.0
+                buffers.position_rows[:] = p0 + alpha * (p1 - p0)
+                buffers.orientation_rows[:] = slerp(q0, q1, alpha)
+            buffers.tolerances[:] = tol
+
+        return True
+
+class VelocityGoalSpreader:
+    """
+    Spreads each velocity goal (a per-message displacement) evenly over the
+    observed input period, so a faster solve loop moves the goal by the same
+    total amount as solving once per input message would.
+    """
+    def __init__(self, num_chain, nominal_period=0.01):
+        self.period = nominal_period
+        self.input_buffers = GoalBuffers(num_chain)
+        self.linear = None
+        self.angular = None
+        self.tolerances = None
+        self.remaining = 0.0
+        self.last_stamp = None
+        self.lock = threading.Lock()
+
+    def add(self, ee_vels, tolerances, stamp):
+        with self.lock:
+            linear_vels, angular_vels, tols = self.input_buffers.pack_twists(ee_vels, tolerances)
+            if self.last_stamp is not None:
+                # Smooth the period estimate against input jitter
+                self.period = 0.9 * self.period + 0.1 * (stamp - self.last_stamp)
+            self.last_stamp = stamp
+
+            # Carry over whatever part of the previous goal has not been applied yet
+            if self.linear is not None and self.linear.shape == linear_vels.shape:
+                self.linear = self.remaining * self.linear + linear_vels
+                self.angular = self.remaining * self.angular + angular_vels
+            else:
+                self.linear = linear_vels.copy()
+                self.angular = angular_vels.copy()
+            self.tolerances = tols.copy()
+            self.remaining = 1.0
+
+    def sample(self, dt, buffers):
+        """Write the share of the pending velocity goal due for a dt-long tick into buffers."""
+        with self.lock:
+            if self.linear is None:
+                return False
+
+            if buffers.num_chain * 3 != len(self.linear):
+                buffers.resize(len(self.linear) // 3)
+
+            fraction = min(self.remaining, dt / self.period)
+            self.remaining -= fraction
+            buffers.linear_vels[:] = fraction * self.linear
+            buffers.angular_vels[:] = fraction * self.angular
+            buffers.tolerances[:] = self.tolerances
+
+        return True
@@ -0,0 +1,97 @@
+#! /usr/bin/env python3
+
+import numpy as np
+
+from diagnostic_msgs.msg import DiagnosticStatus, KeyValue
+
+class GoalSkipper:
+    """
+    Decides whether a goal is close enough to the last solved one that the
+    solve can be skipped. A goal is only skipped once the solver has settled,
+    i.e. the previous solve moved no joint by more than joint_threshold, so a
+    solution that is still converging keeps being refined.
+    Velocity goals below the threshold are accumulated rather than dropped, and
+    applied together once they add up to more than the threshold.
+    """
+    def __init__(self, position_threshold=1e-4, rotation_threshold=1e-3, velocity_threshold=1e-4,
+                 joint_threshold=1e-4):
+        self.position_threshold = position_threshold
+        self.rotation_threshold = rotation_threshold
+        self.velocity_threshold = velocity_threshold
+        self.joint_threshold = joint_threshold
+
+        self.last_kind = None
+        self.last_positions = None
+        self.last_orientations = None
+        self.last_tolerances = None
+        self.last_solution = None
+        self.settled = False
+
+        self.pending_linear_vels = None
+        self.pending_angular_vels = None
+        self.skipped = {'pose': 0, 'velocity': 0}
+
+    def invalidate(self):
+        # The solver state changed behind our back (reset, batch solve)
+        self.last_kind = None
+        self.settled = False
+
+    def skip_pose(self, b):
+        if self.last_kind != 'pose' or not self.settled or len(b.positions) != len(self.last_positions):
+            return False
+        if not np.array_equal(b.tolerances, self.last_tolerances):
+            return False
+
+        position_delta = np.linalg.norm(b.position_rows - self.last_positions.reshape((-1, 3)), axis=1)
+        dot = np.abs(np.sum(b.orientation_rows * self.last_orientations.reshape((-1, 4)), axis=1))
+        rotation_delta = 2.0 * np.arccos(np.clip(dot, 0.0, 1.0))
+        if np.max(position_delta) > self.position_threshold or np.max(rotation_delta) > self.rotation_threshold:
+            return False
+
+        self.skipped['pose'] += 1
+        return True
+
+    def skip_velocity(self, b):
+        # On a solve, the accumulated velocities are written back into b
+        if self.pending_linear_vels is None or len(self.pending_linear_vels) != len(b.linear_vels):
+            self.pending_linear_vels = np.zeros(len(b.linear_vels))
+            self.pending_angular_vels = np.zeros(len(b.angular_vels))
+        self.pending_linear_vels += b.linear_vels
+        self.pending_angular_vels += b.angular_vels
+
+        if self.last_kind == 'velocity' and self.settled and \
+                np.max(np.abs(self.pending_linear_vels)) <= self.velocity_threshold and \
+                np.max(np.abs(self.pending_angular_vels)) <= self.velocity_threshold:
+            self.skipped['velocity'] += 1
+            return True
+
+        b.linear_vels[:] = self.pending_linear_vels
+        b.angular_vels[:] = self.pending_angular_vels
+        self.pending_linear_vels[:] = 0.0
+        self.pending_angular_vels[:] = 0.0
+        return False
+
+    def solved(self, kind, b, solution):
+        if self.last_solution is None or len(self.last_solution) != len(solution):
+            self.last_solution = np.array(solution)
+            self.settled = False
+        else:
+            self.settled = np.max(np.abs(solution - self.last_solution)) <= self.joint_threshold
+            self.last_solution[:] = solution
+
+        self.last_kind = kind
+        if kind == 'pose':
+            self.last_positions = b.positions.copy()
+            self.last_orientations = b.orientations.copy()
+            self.last_tolerances = b.tolerances.copy()
+
+    def total_skipped(self):
+        return sum(self.skipped.values())
+
+    def diagnostic_status(self):
+        status = DiagnosticStatus()
+        status.level = DiagnosticStatus.OK
+        status.name = 'relaxed_ik: skipped solves'
+        status.message = '{} solves skipped'.format(self.total_skipped())
+        status.values = [KeyValue(kind, str(n)) for kind, n in self.skipped.items()]
+        return [status]
@@ -0,0 +1,170 @@
+#! /usr/bin/env python3
+
+import numpy as np
+
+# KDL joint types: RotAxis, RotX, RotY, RotZ, TransAxis, TransX, TransY, TransZ; 8 is fixed
+ROTATIONAL = (0, 1, 2, 3)
+TRANSLATIONAL = (4, 5, 6, 7)
+
+def frame_to_rp(frame):
+    R = np.array([[frame.M[i, j] for j in range(3)] for i in range(3)])
+    p = np.array([frame.p[i] for i in range(3)])
+    return R, p
+
+def matrix_to_quaternion(R):
+    """(N, 3, 3) rotation matrices -> (N, 4) xyzw quaternions with w >= 0."""
+    n = len(R)
+    q = np.empty((n, 4))
+    m00, m11, m22 = R[:, 0, 0], R[:, 1, 1], R[:, 2, 2]
+    trace = m00 + m11 + m22
+    # Pick the numerically safest formula per rotation
+    case = np.argmax(np.stack([trace, m00, m11, m22], axis=1), axis=1)
+
+    k = case == 0
+    s = 2.0 * np.sqrt(np.maximum(1.0 + trace[k], 0.0))
+    q[k, 3] = 0.25 * s
+    q[k, 0] = (R[k, 2, 1] - R[k, 1, 2]) / s
+    q[k, 1] = (R[k, 0, 2] - R[k, 2, 0]) / s
+    q[k, 2] = (R[k, 1, 0] - R[k, 0, 1]) / s
+
+    k = case == 1
+    s = 2.0 * np.sqrt(np.maximum(1.0 + m00[k] - m11[k] - m22[k], 0.0))
+    q[k, 3] = (R[k, 2, 1] - R[k, 1, 2]) / s
+    q[k, 0] = 0.25 * s
+    q[k, 1] = (R[k, 0, 1] + R[k, 1, 0]) / s
+    q[k, 2] = (R[k, 0, 2] + R[k, 2, 0]) / s
+
+    k = case == 2
+    s = 2.0 * np.sqrt(np.maximum(1.0 + m11[k] - m00[k] - m22[k], 0.0))
+    q[k, 3] = (R[k, 0, 2] - R[k, 2, 0]) / s
+    q[k, 0] = (R[k, 0, 1] + R[k, 1, 0]) / s
+    q[k, 1] = 0.25 * s
+    q[k, 2] = (R[k, 1, 2] + R[k, 2, 1]) / s
+
+    k = case == 3
+    s = 2.0 * np.sqrt(np.maximum(1.0 + m22[k] - m00[k] - m11[k], 0.0))
+    q[k, 3] = (R[k, 1, 0] - R[k, 0, 1]) / s
+    q[k, 0] = (R[k, 0, 2] + R[k, 2, 0]) / s
+    q[k, 1] = (R[k, 1, 2] + R[k, 2, 1]) / s
+    q[k, 2] = 0.25 * s
+
+    q[q[:, 3] < 0.0] *= -1.0
+    return q
+
+class ChainModel:
+    """
+    Fixed transforms and joint axes of a KDL chain, read once so forward
+    kinematics can be evaluated for many configurations at a time with NumPy.
+
+    KDL evaluates a segment as joint.pose(q) * f_tip, where a joint at angle q
+    is a rotation about (or translation along) its axis placed at its origin,
+    and f_tip = joint.pose(0).Inverse() * segment.pose(0). Fixed segments are
+    folded into the transform that precedes the next joint. Joint scale and
+    offset are taken to be 1 and 0, as kdl_parser builds them.
+    """
+    def __init__(self, chain):
+        # Per moving joint: (rotational, origin, axis, R and p of the constant transform before it)
+        self.joints = []
+        R_pre, p_pre = np.eye(3), np.zeros(3)
+        for j in range(chain.getNrOfSegments()):
+            segment = chain.getSegment(j)
+            joint = segment.getJoint()
+            R_seg, p_seg = frame_to_rp(segment.pose(0.0))
+            if joint.getType() not in ROTATIONAL + TRANSLATIONAL:
+                p_pre = p_pre + R_pre @ p_seg
+                R_pre = R_pre @ R_seg
+                continue
+
+            origin = np.array([joint.JointOrigin()[i] for i in range(3)])
+            axis = np.array([joint.JointAxis()[i] for i in range(3)])
+            self.joints.append((joint.getType() in ROTATIONAL, origin, axis, R_pre, p_pre))
+
+            # f_tip = joint.pose(0)^-1 * segment.pose(0); joint.pose(0) is a pure translation by origin
+            R_pre, p_pre = R_seg, p_seg - origin
+        self.R_post = R_pre
+        self.p_post = p_pre
+        self.num_jnts = len(self.joints)
+
+    @classmethod
+    def from_arrays(cls, rotational, origins, axes, R_pre, p_pre, R_post, p_post):
+        """Rebuilds a model from the arrays returned by arrays(), without KDL."""
+        model = cls.__new__(cls)
+        model.joints = list(zip(np.asarray(rotational, dtype=bool).tolist(), origins, axes, R_pre, p_pre))
+        model.R_post = R_post
+        model.p_post = p_post
+        model.num_jnts = len(model.joints)
+        return model
+
+    def arrays(self):
+        """The per-joint fields stacked into arrays, then R_post and p_post."""
+        rotational = np.array([j[0] for j in self.joints], dtype=bool)
+        origins, axes, R_pre, p_pre = [np.reshape([j[k] for j in self.joints], shape)
+                                       for k, shape in ((1, (-1, 3)), (2, (-1, 3)), (3, (-1, 3, 3)), (4, (-1, 3)))]
+        return rotational, origins, axes, R_pre, p_pre, self.R_post, self.p_post
+
+    def forward(self, q):
+        """
+        (N, num_jnts) joint angles -> rotation (N, 3, 3) and position (N, 3) of
+        the chain tip, plus each joint's axis (N, num_jnts, 3) and origin
+        (N, num_jnts, 3) in the chain base frame.
+        """
+        n = len(q)
+        R = np.broadcast_to(np.eye(3), (n, 3, 3)).copy()
+        p = np.zeros((n, 3))
+        axes = np.empty((n, self.num_jnts, 3))
+        origins = np.empty((n, self.num_jnts, 3))
+        for k, (rotational, origin, axis, R_pre, p_pre) in enumerate(self.joints):
+            p += R @ p_pre
+            R = R @ R_pre
+            p += R @ origin
+            axes[:, k] = R @ axis
+            origins[:, k] = p
+            if rotational:
+                R = R @ axis_angle_matrices(axis, q[:, k])
+            else:
+                p += axes[:, k] * q[:, k, None]
+        p += R @ self.p_post
+        R = R @ self.R_post
+        return R, p, axes, origins
+
+    def fk(self, q):
+        """(N, num_jnts) joint angles -> (N, 3, 3) rotations and (N, 3) positions of the chain tip."""
+        R, p, _, _ = self.forward(q)
+        return R, p
+
+    def jacobian(self, q):
+        """
+        Geometric Jacobians at the chain tip in the base frame, (N, 6, num_jnts):
+        rows are linear then angular velocity, as in KDL.
+        """
+        R, p, axes, origins = self.forward(q)
+        J = np.zeros((len(q), 6, self.num_jnts))
+        for k, (rotational, _, _, _, _) in enumerate(self.joints):
+            if rotational:
+                J[:, :3, k] = np.cross(axes[:, k], p - origins[:, k])
+                J[:, 3:, k] = axes[:, k]
+            else:
+                J[:, :3, k] = axes[:, k]
+        return J
+
+def axis_angle_matrices(axis, angles):
+    """Rotation matrices about a unit axis for each angle (Rodrigues' formula): (N,) -> (N, 3, 3)."""
+    x, y, z = axis
+    K = np.array([[0.0, -z, y], [z, 0.0, -x], [-y, x, 0.0]])
+    s = np.sin(angles)[:, None, None]
+    c = np.cos(angles)[:, None, None]
+    return np.eye(3) + s * K + (1.0 - c) * (K @ K)
+
+def singular_values(J):
+    """Singular values of (..., m, n) Jacobians, largest first."""
+    return np.linalg.svd(J, compute_uv=False)
+
+def manipulability(J):
+    """Yoshikawa manipulability sqrt(det(J J^T)), the product of the singular values."""
+    return np.prod(singular_values(J), axis=-1)
+
+def condition_number(J):
+    """Ratio of the largest to the smallest singular value; inf at a singularity."""
+    sv = singular_values(J)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(sv[..., -1] > 0.0, sv[..., 0] / sv[..., -1], np.inf)
@@ -1,5 +1,6 @@
 #! /usr/bin/env python3
 
+import actionlib
 import csv
 import ctypes
 import numpy as np
@@ -14,10 +15,12 @@ import ranged_ik.msg
 import ranged_ik.srv
 import think_ahead_ik.srv
 from timeit import default_timer as timer
-from geometry_msgs.msg import Pose, Twist, Vector3
-from relaxed_ik_ros1.msg import EEPoseGoals, EEVelGoals
+from geometry_msgs.msg import Twist, Vector3
+from relaxed_ik_ros1.msg import EEPoseGoals, EEVelGoals, SolvePoseAction, SolvePoseGoal
 from relaxed_ik_ros1.srv import IKPoseRequest,  IKPose
+from pose_adapter import pose_from_array
 from robot import Robot
+from trajectories import square_path
 
 path_to_src = rospkg.RosPack().get_path('relaxed_ik_ros1') + '/relaxed_ik_core'
 
@@ -34,6 +37,12 @@ class TraceALine:
         except:
             self.use_topic_not_service = False
 
+        # Send goals to the solve_pose action without waiting for the result
+        try:
+            self.use_action = rospy.get_param('~use_action')
+        except:
+            self.use_action = False
+
         try: 
             self.loop = rospy.get_param('~loop')
         except:
@@ -64,12 +73,15 @@ class TraceALine:
         rospy.set_param('robot_description', urdf_string)
 
         self.robot = Robot(setting_file_path)
-        self.starting_ee_poses =  self.robot.fk(settings['starting_config'])
+        self.starting_ee_poses = self.robot.fk_array(settings['starting_config'])
 
         self.trajectory = self.generate_trajectory()
 
         if self.use_topic_not_service:
             self.ee_pose_pub = rospy.Publisher('relaxed_ik/ee_pose_goals', EEPoseGoals, queue_size=5)
+        elif self.use_action:
+            self.solve_pose_client = actionlib.SimpleActionClient('relaxed_ik/solve_pose_action', SolvePoseAction)
+            self.solve_pose_client.wait_for_server()
         else:
             rospy.wait_for_service('relaxed_ik/solve_pose')
             self.ik_pose_service = rospy.ServiceProxy('relaxed_ik/solve_pose', IKPose)
@@ -87,47 +99,12 @@ class TraceALine:
         self.timer = rospy.Timer(rospy.Duration(0.1), self.timer_callback)
 
     def generate_trajectory(self):
-        num_points = 50
-        trajectory = []
-        z = []
-        y = []
-        for k in range(self.robot.num_chain):
-            z.append(self.starting_ee_poses[k].position.z)
-            y.append(self.starting_ee_poses[k].position.y)
-
-        delta = 0.3 / num_points
-        dz = [0, -delta, 0, delta]
-        dy = [delta, 0, -delta, 0]
-
-        for i in range(4):
-            for j in range(num_points):
-                poses = self.copy_poses(self.starting_ee_poses)
-                for k in range(self.robot.num_chain):
-                    poses[k].position.z = z[k]
-                    poses[k].position.y = y[k]
-                    z[k] += dz[i]
-                    y[k] += dy[i]
-                trajectory.append(poses)
-
+        # (num_points, num_chain, 7) array of x, y, z, qx, qy, qz, qw
+        positions = square_path(self.starting_ee_poses[:, :3])
+        trajectory = np.repeat(self.starting_ee_poses[None, :, :], len(positions), axis=0)
+        trajectory[:, :, :3] = positions
         return trajectory
 
-    def copy_poses(self, input_poses):
-        output_poses = []
-        for i in range(len(input_poses)):
-            output_poses.append(self.copy_pose(input_poses[i]))
-        return output_poses
-    
-    def copy_pose(self, input_pose):
-        output_pose = Pose()
-        output_pose.position.x = input_pose.position.x
-        output_pose.position.y = input_pose.position.y
-        output_pose.position.z = input_pose.position.z
-        output_pose.orientation.x = input_pose.orientation.x
-        output_pose.orientation.y = input_pose.orientation.y
-        output_pose.orientation.z = input_pose.orientation.z
-        output_pose.orientation.w = input_pose.orientation.w
-        return output_pose
-
     def timer_callback(self, event):
         if self.trajectory_index >= len(self.trajectory):
             if self.loop:
@@ -140,16 +117,27 @@ class TraceALine:
         if self.use_topic_not_service:
             ee_pose_goals = EEPoseGoals()
             for i in range(self.robot.num_chain):
-                ee_pose_goals.ee_poses.append(self.trajectory[self.trajectory_index][i])
+                ee_pose_goals.ee_poses.append(pose_from_array(self.trajectory[self.trajectory_index][i]))
                 if i < len(self.tolerances):
                     ee_pose_goals.tolerances.append(self.tolerances[i])
                 else:
                     ee_pose_goals.tolerances.append(self.tolerances[0])
             self.ee_pose_pub.publish(ee_pose_goals)
+        elif self.use_action:
+            goal = SolvePoseGoal()
+            goal.max_iterations = 1
+            for i in range(self.robot.num_chain):
+                goal.ee_poses.append(pose_from_array(self.trajectory[self.trajectory_index][i]))
+                if i < len(self.tolerances):
+                    goal.tolerances.append(self.tolerances[i])
+                else:
+                    goal.tolerances.append(self.tolerances[0])
+            # A goal still in flight is preempted by this one
+            self.solve_pose_client.send_goal(goal)
         else:
             req = IKPoseRequest()
             for i in range(self.robot.num_chain):
-                req.ee_poses.append(self.trajectory[self.trajectory_index][i])
+                req.ee_poses.append(pose_from_array(self.trajectory[self.trajectory_index][i]))
                 if i < len(self.tolerances):
                     req.tolerances.append(self.tolerances[i])
                 else:
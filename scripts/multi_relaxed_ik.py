@@ -0,0 +1,44 @@
+#! /usr/bin/env python3
+
+'''
+Serves several robots from one process. Each entry of ~setting_file_paths gets
+its own RelaxedIKRust and Robot, with topics and services under the matching
+entry of ~namespaces (default: robot_0, robot_1, ...), e.g.
+/robot_0/relaxed_ik/ee_pose_goals. Each robot reads its parameters from
+~<namespace>/ (e.g. ~robot_0/solve_log_path), falling back to the node's own
+~ parameters. With ~use_solver_thread set, solves run on a shared thread pool;
+the relaxed_ik_core calls go through ctypes, which releases the GIL, so robots
+are solved in parallel.
+'''
+
+import rospy
+
+from concurrent.futures import ThreadPoolExecutor
+from relaxed_ik_rust import RelaxedIK
+
+if __name__ == '__main__':
+    rospy.init_node('multi_relaxed_ik')
+
+    setting_file_paths = rospy.get_param('~setting_file_paths')
+
+    try:
+        namespaces = rospy.get_param('~namespaces')
+    except:
+        namespaces = ['robot_{}'.format(i) for i in range(len(setting_file_paths))]
+
+    assert len(namespaces) == len(setting_file_paths), \
+            "The number of namespaces should match the number of setting files"
+
+    try:
+        num_threads = rospy.get_param('~num_threads')
+    except:
+        num_threads = len(setting_file_paths)
+
+    executor = ThreadPoolExecutor(max_workers=num_threads)
+    rospy.on_shutdown(lambda: executor.shutdown(wait=False))
+
+    solvers = []
+    for setting_file_path, namespace in zip(setting_file_paths, namespaces):
+        solvers.append(RelaxedIK(setting_file_path, namespace, executor))
+
+    rospy.spin()
@@ -0,0 +1,102 @@
+#! /usr/bin/env python3
+
+import numpy as np
+import time
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from diagnostic_msgs.msg import DiagnosticStatus, KeyValue
+from quality_monitor import articulated_limits, goal_errors
+
+def diverse_configurations(lower, upper, n, rng, candidates_per_seed=50):
+    # Greedy farthest-point selection among uniform samples, distances scaled by joint range
+    candidates = rng.uniform(lower, upper, size=(n * candidates_per_seed, len(lower)))
+    scaled = candidates / np.maximum(upper - lower, 1e-9)
+    chosen = [0]
+    distance = np.linalg.norm(scaled - scaled[0], axis=1)
+    for _ in range(n - 1):
+        k = int(np.argmax(distance))
+        chosen.append(k)
+        distance = np.minimum(distance, np.linalg.norm(scaled - scaled[k], axis=1))
+    return candidates[chosen]
+
+class MultiStartSolver:
+    """
+    Re-solves hard pose goals from several seeds in parallel. When the regular
+    solution misses the goal by more than cost_threshold, every extra solver is
+    reset to one of a cached set of diverse seed configurations and iterated on
+    the goal until it converges, max_iterations is reached or the time budget
+    runs out. The lowest-cost result wins; a winning solution replaces the
+    seed closest to it, so the seed set adapts to where goals actually are.
+    Cost is the worst chain's position error plus rotation_weight times its
+    rotation error, counting only error beyond the goal's tolerances as the
+    solver's objective does.
+    """
+    def __init__(self, robot, solvers, budget=0.02, cost_threshold=0.01, rotation_weight=0.1,
+                 max_iterations=50, seed=0):
+        self.robot = robot
+        self.solvers = solvers
+        self.budget = budget
+        self.cost_threshold = cost_threshold
+        self.rotation_weight = rotation_weight
+        self.max_iterations = max_iterations
+
+        lower, upper = articulated_limits(robot)
+        self.seeds = diverse_configurations(lower, upper, len(solvers), np.random.default_rng(seed))
+        self.executor = ThreadPoolExecutor(max_workers=len(solvers))
+
+        self.runs = 0
+        self.improved = 0
+
+    def cost(self, joint_angles, b):
+        # fk_batch keeps no shared buffers, unlike robot.fk, which may be in use on other threads
+        fk = self.robot.fk_batch(joint_angles)[0]
+        position_error, rotation_error = goal_errors(fk, b.position_rows, b.orientation_rows, b.tolerance_rows)
+        return np.max(position_error + self.rotation_weight * rotation_error)
+
+    def run_start(self, solver, seed, b, deadline):
+        solver.reset(seed)
+        previous = None
+        for _ in range(self.max_iterations):
+            q = solver.solve_position(b)
+            if previous is not None and np.max(np.abs(q - previous)) < 1e-6:
+                break
+            previous = q.copy()
+            if time.perf_counter() > deadline:
+                break
+        return q.copy()
+
+    def solve(self, b, solution):
+        """Returns solution, or a lower-cost one from the extra seeds. b must not change until this returns."""
+        best_cost = self.cost(solution, b)
+        if best_cost <= self.cost_threshold:
+            return solution
+
+        self.runs += 1
+        deadline = time.perf_counter() + self.budget
+        futures = [self.executor.submit(self.run_start, solver, seed, b, deadline)
+                   for solver, seed in zip(self.solvers, self.seeds)]
+        # Workers check the deadline after every solve, so this overruns the budget by one solve at most
+        wait(futures)
+
+        best = solution
+        for f in futures:
+            q = f.result()
+            c = self.cost(q, b)
+            if c < best_cost:
+                best, best_cost = q, c
+
+        if best is not solution:
+            self.improved += 1
+            k = int(np.argmin(np.linalg.norm(self.seeds - best, axis=1)))
+            self.seeds[k] = best
+        return best
+
+    def diagnostic_status(self):
+        status = DiagnosticStatus()
+        status.level = DiagnosticStatus.OK
+        status.name = 'relaxed_ik: multi-start'
+        status.message = '{} of {} multi-start solves improved the solution'.format(self.improved, self.runs)
+        status.values = [KeyValue('runs', str(self.runs)),
+                         KeyValue('improved', str(self.improved)),
+                         KeyValue('starts', str(len(self.solvers)))]
+        return [status]
@@ -0,0 +1,34 @@
+#! /usr/bin/env python3
+
+'''
+Conversions between geometry_msgs/Pose and the (x, y, z, qx, qy, qz, qw) rows
+used by the array FK in Robot.
+'''
+
+import numpy as np
+
+from geometry_msgs.msg import Pose
+
+def pose_from_array(a, pose=None):
+    if pose is None:
+        pose = Pose()
+    pose.position.x = a[0]
+    pose.position.y = a[1]
+    pose.position.z = a[2]
+    pose.orientation.x = a[3]
+    pose.orientation.y = a[4]
+    pose.orientation.z = a[5]
+    pose.orientation.w = a[6]
+    return pose
+
+def poses_from_array(a):
+    return [pose_from_array(row) for row in a]
+
+def array_from_poses(poses, out=None):
+    if out is None:
+        out = np.empty((len(poses), 7))
+    for i, pose in enumerate(poses):
+        p = pose.position
+        o = pose.orientation
+        out[i] = (p.x, p.y, p.z, o.x, o.y, o.z, o.w)
+    return out
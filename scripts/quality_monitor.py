@@ -0,0 +1,166 @@
+#! /usr/bin/env python3
+
+import collections
+import numpy as np
+import queue
+import rospy
+import threading
+
+from diagnostic_msgs.msg import DiagnosticStatus, KeyValue
+
+def articulated_limits(robot):
+    # Joint limits in solver order; unlimited joints get one turn either way
+    lower = []
+    upper = []
+    for name in robot.articulated_joint_names:
+        i = robot.all_joint_names.index(name)
+        lo, hi = robot.joint_lower_limits[i], robot.joint_upper_limits[i]
+        lower.append(-np.pi if lo is None else lo)
+        upper.append(np.pi if hi is None else hi)
+    return np.array(lower, dtype=float), np.array(upper, dtype=float)
+
+def rotation_vectors(q_from, q_to):
+    # Rotation vectors (axis * angle, base frame) of q_to * q_from^-1 for (n, 4) xyzw quaternions
+    x1, y1, z1, w1 = np.reshape(q_from, (-1, 4)).T
+    x2, y2, z2, w2 = np.reshape(q_to, (-1, 4)).T
+    w = w2 * w1 + x2 * x1 + y2 * y1 + z2 * z1
+    v = np.stack([-w2 * x1 + x2 * w1 - y2 * z1 + z2 * y1,
+                  -w2 * y1 + x2 * z1 + y2 * w1 - z2 * x1,
+                  -w2 * z1 - x2 * y1 + y2 * x1 + z2 * w1], axis=1)
+    # q and -q are the same rotation; take the short way round
+    v[w < 0.0] *= -1.0
+    w = np.abs(w)
+    s = np.linalg.norm(v, axis=1)
+    angle = 2.0 * np.arctan2(s, w)
+    scale = np.where(s > 1e-12, angle / np.maximum(s, 1e-12), 2.0)
+    return v * scale[:, None]
+
+def goal_errors(fk, positions, orientations, tolerances=None):
+    """
+    Per-chain position error (m) and rotation error (rad) of (num_chain, 7) fk
+    poses against a goal. With tolerances ((num_chain, 6): linear then angular,
+    as in the goal buffers) only the part of each axis' error beyond its
+    tolerance counts, as in the solver's objective.
+    """
+    position_error = np.abs(fk[:, :3] - np.reshape(positions, (-1, 3)))
+    rotation_error = np.abs(rotation_vectors(orientations, fk[:, 3:]))
+    if tolerances is not None:
+        tolerances = np.reshape(tolerances, (-1, 6))
+        position_error = np.maximum(position_error - tolerances[:, :3], 0.0)
+        rotation_error = np.maximum(rotation_error - tolerances[:, 3:], 0.0)
+    return np.linalg.norm(position_error, axis=1), np.linalg.norm(rotation_error, axis=1)
+
+def pose_errors(robot, joint_angles, positions, orientations, tolerances=None):
+    # goal_errors of fk(joint_angles)
+    return goal_errors(robot.fk_array(joint_angles), positions, orientations, tolerances)
+
+class QualityMonitor:
+    """
+    Checks a sample of published solutions on a background thread: fk position
+    and rotation error beyond the goal's tolerances, and distance to the nearest
+    joint limit.
+    Every sample_every-th solution is queued; if the checker falls behind,
+    samples are dropped rather than slowing the solver down. Statistics cover
+    the last window checked solutions.
+    """
+    def __init__(self, robot, sample_every=10, position_threshold=0.01, rotation_threshold=0.05,
+                 window=1000, queue_size=16):
+        self.robot = robot
+        self.sample_every = sample_every
+        self.position_threshold = position_threshold
+        self.rotation_threshold = rotation_threshold
+        self.lower, self.upper = articulated_limits(robot)
+
+        self.count = 0
+        self.dropped = 0
+        self.checked = 0
+        self.misses = 0
+        self.position_errors = collections.deque(maxlen=window)
+        self.rotation_errors = collections.deque(maxlen=window)
+        self.limit_margins = collections.deque(maxlen=window)
+        self.lock = threading.Lock()
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self.run, name='relaxed_ik_quality')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, joint_angles, positions=None, orientations=None, tolerances=None):
+        # Without a goal pose only the joint limit margin is checked
+        self.count += 1
+        if self.count % self.sample_every != 0:
+            return
+        item = (np.array(joint_angles),
+                None if positions is None else np.array(positions),
+                None if orientations is None else np.array(orientations),
+                None if tolerances is None else np.array(tolerances))
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                self.check(*item)
+            except Exception as e:
+                rospy.logerr("Quality monitor failed: {}".format(e))
+
+    def check(self, joint_angles, positions, orientations, tolerances):
+        margin = np.min(np.minimum(joint_angles - self.lower, self.upper - joint_angles))
+        position_error = None
+        if positions is not None:
+            # Deviations the goal's tolerances allow are not misses
+            position_error, rotation_error = pose_errors(self.robot, joint_angles, positions, orientations,
+                                                         tolerances)
+            position_error = np.max(position_error)
+            rotation_error = np.max(rotation_error)
+
+        with self.lock:
+            self.checked += 1
+            self.limit_margins.append(margin)
+            if position_error is None:
+                return
+            self.position_errors.append(position_error)
+            self.rotation_errors.append(rotation_error)
+            if position_error > self.position_threshold or rotation_error > self.rotation_threshold:
+                self.misses += 1
+                rospy.logwarn_throttle(1.0, "Solution misses the goal by {:.4f} m, {:.4f} rad".format(
+                                            position_error, rotation_error))
+
+    def diagnostic_status(self):
+        with self.lock:
+            position_errors = np.array(self.position_errors)
+            rotation_errors = np.array(self.rotation_errors)
+            margins = np.array(self.limit_margins)
+            checked, misses = self.checked, self.misses
+
+        status = DiagnosticStatus()
+        status.name = 'relaxed_ik: solution quality'
+        status.level = DiagnosticStatus.OK
+        status.message = '{} of {} checked solutions missed the goal'.format(misses, checked)
+        if len(position_errors) > 0 and (position_errors.max() > self.position_threshold or
+                                         rotation_errors.max() > self.rotation_threshold):
+            status.level = DiagnosticStatus.WARN
+        if len(margins) > 0 and margins.min() < 0.0:
+            status.level = DiagnosticStatus.WARN
+            status.message += ', joint limits exceeded'
+
+        status.values = [KeyValue('checked', str(checked)),
+                         KeyValue('misses', str(misses)),
+                         KeyValue('dropped samples', str(self.dropped))]
+        if len(position_errors) > 0:
+            status.values += [KeyValue('position error mean (m)', '{:.6f}'.format(position_errors.mean())),
+                              KeyValue('position error max (m)', '{:.6f}'.format(position_errors.max())),
+                              KeyValue('rotation error mean (rad)', '{:.6f}'.format(rotation_errors.mean())),
+                              KeyValue('rotation error max (rad)', '{:.6f}'.format(rotation_errors.max()))]
+        if len(margins) > 0:
+            status.values += [KeyValue('joint limit margin min (rad)', '{:.6f}'.format(margins.min()))]
+        return [status]
@@ -0,0 +1,156 @@
+#! /usr/bin/env python3
+
+'''
+Voxelized reachability map of the configured robot, built offline by
+build_reachability_map.py from FK of configurations sampled within the joint
+limits. For every chain, each voxel of the grid holds a bitmask of the
+directions the end effector's approach (z) axis was seen pointing in while its
+tip was inside the voxel; 0 means no sample reached the voxel at all.
+
+The map is an under-approximation of the true workspace, as dense as the
+number of samples it was built from, so a miss near the workspace boundary or
+for a rarely sampled orientation is not proof that a goal is unreachable.
+'''
+
+import numpy as np
+
+from diagnostic_msgs.msg import DiagnosticStatus, KeyValue
+from pose_adapter import array_from_poses
+from quality_monitor import articulated_limits
+
+def sphere_directions(n=64):
+    # Roughly uniform unit vectors on a Fibonacci spiral
+    k = np.arange(n) + 0.5
+    z = 1.0 - 2.0 * k / n
+    r = np.sqrt(1.0 - z * z)
+    theta = np.pi * (1.0 + np.sqrt(5.0)) * k
+    return np.stack([r * np.cos(theta), r * np.sin(theta), z], axis=1)
+
+def approach_axes(orientations):
+    # z axis of the rotation of each (N, 4) xyzw quaternion
+    x, y, z, w = np.reshape(orientations, (-1, 4)).T
+    return np.stack([2.0 * (x * z + w * y), 2.0 * (y * z - w * x), 1.0 - 2.0 * (x * x + y * y)], axis=1)
+
+def direction_bits(directions, axes):
+    # One bit per axis: the direction bin it falls into
+    nearest = np.argmax(axes @ directions.T, axis=1)
+    return np.left_shift(np.uint64(1), nearest.astype(np.uint64))
+
+def merge_voxels(keys, bits):
+    # OR together the bits of repeated voxel keys
+    keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    merged = np.zeros(len(keys), dtype=np.uint64)
+    np.bitwise_or.at(merged, inverse.ravel(), bits)
+    return keys, merged
+
+def build_reachability_map(robot, num_samples, voxel_size=0.05, batch_size=10000, num_directions=64, rng=None):
+    """
+    Samples num_samples configurations uniformly within the joint limits and
+    returns the map as a dict of arrays, ready for np.savez.
+    """
+    assert 0 < num_directions <= 64, "Orientation bins must fit in a 64-bit mask"
+    if rng is None:
+        rng = np.random.default_rng()
+    lower, upper = articulated_limits(robot)
+    directions = sphere_directions(num_directions)
+
+    keys = [np.zeros((0, 3), dtype=np.int64) for _ in range(robot.num_chain)]
+    bits = [np.zeros(0, dtype=np.uint64) for _ in range(robot.num_chain)]
+    poses = np.empty((batch_size, robot.num_chain, 7))
+    for start in range(0, num_samples, batch_size):
+        n = min(batch_size, num_samples - start)
+        q = rng.uniform(lower, upper, size=(n, len(lower)))
+        robot.fk_batch(q, out=poses[:n])
+        for i in range(robot.num_chain):
+            k = np.floor(poses[:n, i, :3] / voxel_size).astype(np.int64)
+            b = direction_bits(directions, approach_axes(poses[:n, i, 3:]))
+            # Merge as we go so memory grows with the workspace, not the sample count
+            keys[i], bits[i] = merge_voxels(np.concatenate([keys[i], k]), np.concatenate([bits[i], b]))
+
+    data = {
+        'voxel_size': np.float64(voxel_size),
+        'directions': directions,
+        'num_samples': np.int64(num_samples),
+        'joint_names': np.array(robot.articulated_joint_names),
+        'num_chain': np.int64(robot.num_chain),
+    }
+    for i in range(robot.num_chain):
+        origin = keys[i].min(axis=0)
+        grid = np.zeros(tuple(keys[i].max(axis=0) - origin + 1), dtype=np.uint64)
+        grid[tuple((keys[i] - origin).T)] = bits[i]
+        data['origin_{}'.format(i)] = origin
+        data['masks_{}'.format(i)] = grid
+    return data
+
+class ReachabilityMap:
+    """
+    Lookups into a map written by build_reachability_map.py. Positions are in
+    the robot base frame, orientations are xyzw quaternions.
+    """
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.voxel_size = float(data['voxel_size'])
+            self.directions = data['directions']
+            self.num_samples = int(data['num_samples'])
+            self.joint_names = data['joint_names'].tolist()
+            self.num_chain = int(data['num_chain'])
+            self.origins = [data['origin_{}'.format(i)] for i in range(self.num_chain)]
+            self.grids = [data['masks_{}'.format(i)] for i in range(self.num_chain)]
+
+    def masks(self, chain, positions):
+        """Orientation bitmask of the voxel holding each (N, 3) position; 0 outside the map."""
+        idx = np.floor(np.reshape(positions, (-1, 3)) / self.voxel_size).astype(np.int64) - self.origins[chain]
+        grid = self.grids[chain]
+        inside = np.all((idx >= 0) & (idx < grid.shape), axis=1)
+        masks = np.zeros(len(idx), dtype=np.uint64)
+        masks[inside] = grid[tuple(idx[inside].T)]
+        return masks
+
+    def reachable(self, chain, positions, orientations=None):
+        """
+        Whether chain's tip was seen at each position, and with orientations
+        given, also with its approach axis in the same direction bin.
+        """
+        masks = self.masks(chain, positions)
+        if orientations is None:
+            return masks != 0
+        bits = direction_bits(self.directions, approach_axes(orientations))
+        return (masks & bits) != 0
+
+class ReachabilityFilter:
+    """
+    Screens incoming pose goals against a ReachabilityMap and counts the ones
+    that miss it, so obviously unreachable goals need not reach the solver.
+    """
+    def __init__(self, reachability_map, check_orientation=False):
+        self.map = reachability_map
+        self.check_orientation = check_orientation
+        self.checked = 0
+        self.unreachable = 0
+
+    def unreachable_chains(self, chain_indices, ee_poses):
+        """Indices of the chains in chain_indices whose goal pose is not in the map."""
+        poses = array_from_poses(ee_poses)
+        missed = []
+        for i, pose in zip(chain_indices, poses):
+            if i >= self.map.num_chain:
+                continue
+            orientation = pose[3:] if self.check_orientation else None
+            if not self.map.reachable(i, pose[:3], orientation)[0]:
+                missed.append(i)
+
+        self.checked += 1
+        if len(missed) > 0:
+            self.unreachable += 1
+        return missed
+
+    def diagnostic_status(self):
+        status = DiagnosticStatus()
+        status.level = DiagnosticStatus.OK
+        status.name = 'relaxed_ik: reachability'
+        status.message = '{} of {} pose goals outside the reachability map'.format(self.unreachable, self.checked)
+        status.values = [KeyValue('checked', str(self.checked)),
+                         KeyValue('unreachable', str(self.unreachable)),
+                         KeyValue('voxel_size', str(self.map.voxel_size)),
+                         KeyValue('check_orientation', str(self.check_orientation))]
+        return [status]
@@ -1,49 +1,294 @@
 #! /usr/bin/env python3
 
-import ctypes
+import actionlib
 import numpy as np
 import os
 import rospkg
 import rospy
 import sys
+import threading
+import time
 import transformations as T
 import yaml
 
-from relaxed_ik_ros1.srv import IKPose, IKPoseResponse
-from relaxed_ik_ros1.msg import EEPoseGoals, EEVelGoals
-from geometry_msgs.msg import Point
-from std_msgs.msg import Float64, Float64MultiArray
+from relaxed_ik_ros1.srv import IKPose, IKPoseResponse, IKPoseBatch, IKPoseBatchResponse
+from relaxed_ik_ros1.msg import EEPoseGoals, EEPoseGoalUpdate, EEVelGoals, HiroVelGoal
+from relaxed_ik_ros1.msg import SolvePoseAction, SolvePoseFeedback, SolvePoseResult
+from std_msgs.msg import Float64, Float64MultiArray, UInt64
 from sensor_msgs.msg import JointState 
-from urdf_parser_py.urdf import URDF
-from kdl_parser import kdl_tree_from_urdf_model
-import PyKDL as kdl
+from diagnostic_msgs.msg import DiagnosticArray
 from robot import Robot
+from goal_buffers import GoalBuffers, pack_pose_batch
+from solve_worker import LatestGoalWorker
+from goal_interpolation import PoseGoalInterpolator, VelocityGoalSpreader
+from stage_timing import StageTimer, NullStageTimer
+from solution_publisher import SolutionPublisher
+from solver_buffers import SolverBuffers
+from solution_cache import SolutionCache
+from solve_log import SolveLogWriter
+from quality_monitor import QualityMonitor
+from goal_skipping import GoalSkipper
+from trajectory_output import TrajectoryStreamer, articulated_vel_limits
+from shared_solution import SharedSolutionWriter
+from multi_start import MultiStartSolver
+from reachability import ReachabilityMap, ReachabilityFilter
 
 path_to_src = rospkg.RosPack().get_path('relaxed_ik_ros1') + '/relaxed_ik_core'
 sys.path.insert(1, path_to_src + '/wrappers')
+import python_wrapper
 from python_wrapper import RelaxedIKRust
 
+def merge_vel_goals(pending, msg):
+    # msg comes straight from the subscriber and is not shared, so it is updated in place
+    if len(pending.ee_vels) != len(msg.ee_vels):
+        return msg
+    for a, b in zip(pending.ee_vels, msg.ee_vels):
+        b.linear.x += a.linear.x
+        b.linear.y += a.linear.y
+        b.linear.z += a.linear.z
+        b.angular.x += a.angular.x
+        b.angular.y += a.angular.y
+        b.angular.z += a.angular.z
+    return msg
+
 class RelaxedIK:
-    def __init__(self):
-        rospy.sleep(1)
+    def __init__(self, setting_file_path=None, namespace='', executor=None):
+        # Topics, services and robot_description are prefixed with the namespace
+        # so several robots can be served from one process. Parameters are looked
+        # up under ~<namespace>/ first, then shared from the node's ~ namespace.
+        self.namespace = namespace.strip('/')
+
+        # Optional pause before startup, e.g. to give other nodes time to come up
+        try:
+            startup_delay = rospy.get_param(self.param_name('startup_delay'))
+        except:
+            startup_delay = 0.0
+        if startup_delay > 0:
+            rospy.sleep(startup_delay)
+
+        # Time spent in each startup phase, reported once the node is up
+        startup_phases = []
+        phase_start = time.perf_counter()
 
         default_setting_file_path = path_to_src + '/configs/settings.yaml'
 
-        setting_file_path = ""
-        try: 
-            setting_file_path = rospy.get_param('~setting_file_path')
-        except:
-            pass
+        if setting_file_path is None:
+            setting_file_path = ""
+            try: 
+                setting_file_path = rospy.get_param(self.param_name('setting_file_path'))
+            except:
+                pass
 
         if setting_file_path == "":
             print("Rviz viewer: no setting file path is given, using the default setting file -- {}".format(default_setting_file_path))
             setting_file_path = default_setting_file_path
 
         try: 
-            self.use_visualization = rospy.get_param('~use_visualization')
+            self.use_visualization = rospy.get_param(self.param_name('use_visualization'))
         except:
             self.use_visualization = False
 
+        try:
+            self.use_solver_thread = rospy.get_param(self.param_name('use_solver_thread'))
+        except:
+            self.use_solver_thread = False
+
+        # Solve on a fixed-rate timer instead of once per input message (0 disables)
+        try:
+            self.solve_rate = rospy.get_param(self.param_name('solve_rate'))
+        except:
+            self.solve_rate = 0.0
+
+        try:
+            self.interpolation_delay = rospy.get_param(self.param_name('interpolation_delay'))
+        except:
+            # None: one observed input period
+            self.interpolation_delay = None
+
+        try:
+            self.max_extrapolation = rospy.get_param(self.param_name('max_extrapolation'))
+        except:
+            self.max_extrapolation = 0.05
+
+        # Also publish bare joint positions as a Float64MultiArray
+        try:
+            self.publish_compact_solution = rospy.get_param(self.param_name('publish_compact_solution'))
+        except:
+            self.publish_compact_solution = False
+
+        try:
+            self.record_stage_latency = rospy.get_param(self.param_name('record_stage_latency'))
+        except:
+            self.record_stage_latency = False
+
+        try:
+            self.latency_csv_path = rospy.get_param(self.param_name('latency_csv_path'))
+        except:
+            self.latency_csv_path = ''
+        if self.latency_csv_path != '' and self.namespace != '':
+            root, ext = os.path.splitext(self.latency_csv_path)
+            self.latency_csv_path = root + '_' + self.namespace.replace('/', '_') + ext
+
+        try:
+            self.diagnostics_rate = rospy.get_param(self.param_name('diagnostics_rate'))
+        except:
+            self.diagnostics_rate = 1.0
+
+        # LRU cache of pose solutions (0 disables)
+        try:
+            self.solution_cache_size = rospy.get_param(self.param_name('solution_cache_size'))
+        except:
+            self.solution_cache_size = 0
+
+        # 'return' publishes a cached solution as is, 'warm_start' seeds the solver with it
+        try:
+            self.solution_cache_mode = rospy.get_param(self.param_name('solution_cache_mode'))
+        except:
+            self.solution_cache_mode = 'return'
+
+        try:
+            self.solution_cache_position_step = rospy.get_param(self.param_name('solution_cache_position_step'))
+        except:
+            self.solution_cache_position_step = 1e-4
+
+        try:
+            self.solution_cache_orientation_step = rospy.get_param(self.param_name('solution_cache_orientation_step'))
+        except:
+            self.solution_cache_orientation_step = 1e-3
+
+        try:
+            self.solution_cache_seed_step = rospy.get_param(self.param_name('solution_cache_seed_step'))
+        except:
+            self.solution_cache_seed_step = 1e-2
+
+        # Record every goal and solution to a memory-mapped log ('' disables).
+        # A namespaced robot gets the namespace added to the file name, e.g. solves_robot_0.log.
+        try:
+            self.solve_log_path = rospy.get_param(self.param_name('solve_log_path'))
+        except:
+            self.solve_log_path = ''
+        if self.solve_log_path != '' and self.namespace != '':
+            root, ext = os.path.splitext(self.solve_log_path)
+            self.solve_log_path = root + '_' + self.namespace.replace('/', '_') + ext
+
+        # Check every n-th solution against the goal with fk (0 disables)
+        try:
+            self.quality_sample_every = rospy.get_param(self.param_name('quality_sample_every'))
+        except:
+            self.quality_sample_every = 0
+
+        try:
+            self.quality_position_threshold = rospy.get_param(self.param_name('quality_position_threshold'))
+        except:
+            self.quality_position_threshold = 0.01
+
+        try:
+            self.quality_rotation_threshold = rospy.get_param(self.param_name('quality_rotation_threshold'))
+        except:
+            self.quality_rotation_threshold = 0.05
+
+        # Skip solves whose goal barely changed since the last one and republish the last solution
+        try:
+            self.skip_unchanged_goals = rospy.get_param(self.param_name('skip_unchanged_goals'))
+        except:
+            self.skip_unchanged_goals = False
+
+        try:
+            self.skip_position_threshold = rospy.get_param(self.param_name('skip_position_threshold'))
+        except:
+            self.skip_position_threshold = 1e-4
+
+        try:
+            self.skip_rotation_threshold = rospy.get_param(self.param_name('skip_rotation_threshold'))
+        except:
+            self.skip_rotation_threshold = 1e-3
+
+        try:
+            self.skip_velocity_threshold = rospy.get_param(self.param_name('skip_velocity_threshold'))
+        except:
+            self.skip_velocity_threshold = 1e-4
+
+        try:
+            self.skip_joint_threshold = rospy.get_param(self.param_name('skip_joint_threshold'))
+        except:
+            self.skip_joint_threshold = 1e-4
+
+        # Also stream solutions as time-parameterized JointTrajectory segments
+        try:
+            self.publish_trajectory = rospy.get_param(self.param_name('publish_trajectory'))
+        except:
+            self.publish_trajectory = False
+
+        try:
+            self.trajectory_window = rospy.get_param(self.param_name('trajectory_window'))
+        except:
+            self.trajectory_window = 5
+
+        try:
+            self.trajectory_min_segment_duration = rospy.get_param(self.param_name('trajectory_min_segment_duration'))
+        except:
+            self.trajectory_min_segment_duration = 0.01
+
+        # The URDF has no acceleration limits, so one limit applies to every joint
+        try:
+            self.trajectory_acceleration_limit = rospy.get_param(self.param_name('trajectory_acceleration_limit'))
+        except:
+            self.trajectory_acceleration_limit = 10.0
+
+        # Also write solutions to a shared-memory ring for consumers on this host ('' disables).
+        # A namespaced robot gets the namespace appended, e.g. relaxed_ik_robot_0.
+        try:
+            self.shared_memory_name = rospy.get_param(self.param_name('shared_memory_name'))
+        except:
+            self.shared_memory_name = ''
+        if self.shared_memory_name != '' and self.namespace != '':
+            self.shared_memory_name += '_' + self.namespace.replace('/', '_')
+
+        try:
+            self.shared_memory_slots = rospy.get_param(self.param_name('shared_memory_slots'))
+        except:
+            self.shared_memory_slots = 16
+
+        # Re-solve goals the regular solve misses from this many extra seeds in parallel (0 disables)
+        try:
+            self.multi_start_count = rospy.get_param(self.param_name('multi_start_count'))
+        except:
+            self.multi_start_count = 0
+
+        try:
+            self.multi_start_budget = rospy.get_param(self.param_name('multi_start_budget'))
+        except:
+            self.multi_start_budget = 0.02
+
+        try:
+            self.multi_start_cost_threshold = rospy.get_param(self.param_name('multi_start_cost_threshold'))
+        except:
+            self.multi_start_cost_threshold = 0.01
+
+        # Screen topic and action pose goals against a map from build_reachability_map.py ('' disables)
+        try:
+            self.reachability_map_path = rospy.get_param(self.param_name('reachability_map_path'))
+        except:
+            self.reachability_map_path = ''
+
+        # 'warn' only logs goals outside the map; 'reject' drops them. The map under-approximates
+        # the workspace, so rejecting can drop valid goals near its boundary.
+        try:
+            self.reachability_action = rospy.get_param(self.param_name('reachability_action'))
+        except:
+            self.reachability_action = 'warn'
+
+        try:
+            self.reachability_check_orientation = rospy.get_param(self.param_name('reachability_check_orientation'))
+        except:
+            self.reachability_check_orientation = False
+
+        # Where Robot caches the parsed model (default: under ROS_HOME; '' disables the cache)
+        try:
+            self.robot_cache_dir = rospy.get_param(self.param_name('robot_cache_dir'))
+        except:
+            self.robot_cache_dir = None
+
         os.chdir(path_to_src )
 
         # Load the infomation
@@ -54,40 +299,193 @@ class RelaxedIK:
        
         urdf_file = open(path_to_src + '/configs/urdfs/' + settings["urdf"], 'r')
         urdf_string = urdf_file.read()
-        rospy.set_param('robot_description', urdf_string)
+        rospy.set_param(self.ns_name('robot_description'), urdf_string)
+        phase_start = self.startup_phase(startup_phases, 'settings', phase_start)
 
         self.relaxed_ik = RelaxedIKRust(setting_file_path)
+        phase_start = self.startup_phase(startup_phases, 'relaxed_ik_core', phase_start)
+        # Serializes solver access between the service, subscriber and solver threads
+        self.solver_lock = threading.Lock()
+
+        # Anything exposing diagnostic_status() is published on relaxed_ik/diagnostics
+        self.diagnostic_sources = []
+        if self.record_stage_latency:
+            self.stage_timer = StageTimer(['unpack', 'solve', 'convert', 'publish'])
+            self.diagnostic_sources.append(self.stage_timer)
+            if self.latency_csv_path != '':
+                rospy.on_shutdown(lambda: self.stage_timer.write_csv(self.latency_csv_path))
+        else:
+            self.stage_timer = NullStageTimer()
+
+        self.solution_cache = None
+        if self.solution_cache_size > 0:
+            self.solution_cache = SolutionCache(self.solution_cache_size,
+                                                position_step=self.solution_cache_position_step,
+                                                orientation_step=self.solution_cache_orientation_step,
+                                                seed_step=self.solution_cache_seed_step)
+            self.diagnostic_sources.append(self.solution_cache)
 
         # Services
-        self.ik_pose_service = rospy.Service('relaxed_ik/solve_pose', IKPose, self.handle_ik_pose)
+        self.ik_pose_service = rospy.Service(self.ns_name('relaxed_ik/solve_pose'), IKPose, self.handle_ik_pose)
+        self.ik_pose_batch_service = rospy.Service(self.ns_name('relaxed_ik/solve_pose_batch'), IKPoseBatch, self.handle_ik_pose_batch)
 
         # Publishers
-        self.angles_pub = rospy.Publisher('relaxed_ik/joint_angle_solutions', JointState, queue_size=1)
         if self.use_visualization:
-            self.vis_ee_pub = rospy.Publisher('relaxed_ik/vis_ee_poses', EEPoseGoals, queue_size=1)
-
-        self.robot = Robot(setting_file_path)
-
-        self.js_msg = JointState()
-        self.js_msg.name = self.robot.articulated_joint_names
-        self.js_msg.position = []
+            self.vis_ee_pub = rospy.Publisher(self.ns_name('relaxed_ik/vis_ee_poses'), EEPoseGoals, queue_size=1)
+
+        # Settings and URDF are already loaded, so Robot does not read them again
+        self.robot = Robot(setting_file_path, settings, urdf_string, self.robot_cache_dir)
+        phase_start = self.startup_phase(startup_phases, 'robot model', phase_start)
+        # Shared by the service, action, subscriber and solver threads: only touch
+        # goal_buffers and solver with solver_lock held, from packing to publishing
+        self.goal_buffers = GoalBuffers(self.robot.num_chain)
+        self.solver = SolverBuffers(self.relaxed_ik, len(self.robot.articulated_joint_names),
+                                    getattr(python_wrapper, 'lib', None))
+
+        # Joint names never change, so they are serialized once up front
+        compact_topic = self.ns_name('relaxed_ik/joint_angle_solutions_compact') if self.publish_compact_solution else None
+        self.solution_pub = SolutionPublisher(self.ns_name('relaxed_ik/joint_angle_solutions'),
+                                              self.robot.articulated_joint_names, compact_topic)
 
         if 'starting_config' not in settings:
-            settings['starting_config'] = [0.0] * len(self.js_msg.name)
+            settings['starting_config'] = [0.0] * len(self.robot.articulated_joint_names)
         else:
-            assert len(settings['starting_config']) == len(self.js_msg.name), \
+            assert len(settings['starting_config']) == len(self.robot.articulated_joint_names), \
                     "Starting config length does not match the number of joints"
-            for i in range(len(self.js_msg.name)):
-                self.js_msg.position.append( settings['starting_config'][i] )
+        self.last_solution = np.array(settings['starting_config'], dtype=float)
+
+        # Latest pose goal for every chain. Full and partial goal messages are merged
+        # into it on arrival; chains without a goal yet hold their starting pose.
+        self.pose_goal = GoalBuffers(self.robot.num_chain)
+        self.pose_goal.pack_poses(self.robot.fk(self.last_solution), [])
+        self.pose_goal_lock = threading.Lock()
+
+        self.solve_log = None
+        if self.solve_log_path != '':
+            self.solve_log = SolveLogWriter(self.solve_log_path, self.robot.num_chain,
+                                            len(self.robot.articulated_joint_names))
+            rospy.on_shutdown(self.solve_log.close)
+
+        self.trajectory_streamer = None
+        if self.publish_trajectory:
+            self.trajectory_streamer = TrajectoryStreamer(self.ns_name('relaxed_ik/joint_trajectory'),
+                                                          self.robot.articulated_joint_names,
+                                                          articulated_vel_limits(self.robot),
+                                                          self.trajectory_acceleration_limit,
+                                                          self.trajectory_window,
+                                                          self.trajectory_min_segment_duration)
+
+        self.shared_solution = None
+        if self.shared_memory_name != '':
+            self.shared_solution = SharedSolutionWriter(self.shared_memory_name, len(self.robot.articulated_joint_names),
+                                                        self.shared_memory_slots)
+            rospy.on_shutdown(self.shared_solution.close)
+
+        self.multi_start = None
+        if self.multi_start_count > 0:
+            solvers = [SolverBuffers(RelaxedIKRust(setting_file_path), len(self.robot.articulated_joint_names),
+                                     getattr(python_wrapper, 'lib', None)) for _ in range(self.multi_start_count)]
+            self.multi_start = MultiStartSolver(self.robot, solvers, self.multi_start_budget,
+                                                self.multi_start_cost_threshold)
+            self.diagnostic_sources.append(self.multi_start)
+
+        self.reachability = None
+        if self.reachability_map_path != '':
+            reachability_map = ReachabilityMap(self.reachability_map_path)
+            if reachability_map.joint_names != self.robot.articulated_joint_names:
+                rospy.logwarn("Reachability map {} was built for joints {}".format(self.reachability_map_path,
+                                                                                   reachability_map.joint_names))
+            self.reachability = ReachabilityFilter(reachability_map, self.reachability_check_orientation)
+            self.diagnostic_sources.append(self.reachability)
+
+        self.goal_skipper = None
+        if self.skip_unchanged_goals:
+            self.goal_skipper = GoalSkipper(self.skip_position_threshold, self.skip_rotation_threshold,
+                                            self.skip_velocity_threshold, self.skip_joint_threshold)
+            self.diagnostic_sources.append(self.goal_skipper)
+
+        self.quality_monitor = None
+        if self.quality_sample_every > 0:
+            self.quality_monitor = QualityMonitor(self.robot, self.quality_sample_every,
+                                                  self.quality_position_threshold, self.quality_rotation_threshold)
+            self.diagnostic_sources.append(self.quality_monitor)
+            rospy.on_shutdown(self.quality_monitor.stop)
+
+        self.hiro_tolerances = np.zeros(6)
+        self.hiro_history_index = np.arange(HiroVelGoal.HISTORY_CAPACITY)
         
+        # Drop stale goals and fold pending EE velocity goals together instead of queueing them behind a slow solve
+        self.solver_worker = None
+        if self.use_solver_thread:
+            self.latency_pub = rospy.Publisher(self.ns_name('relaxed_ik/solve_latency'), Float64, queue_size=1)
+            self.dropped_goals_pub = rospy.Publisher(self.ns_name('relaxed_ik/dropped_goals'), UInt64, queue_size=1)
+            self.solver_worker = LatestGoalWorker({
+                'pose': self.solve_pose_goals,
+                'velocity': self.solve_pose_vels,
+                'hiro_velocity': self.solve_hiro_pose_vels,
+                'hiro_vel_goal': self.solve_hiro_vel_goal,
+            }, on_solved=self.solved_cb, executor=executor, mergers={
+                # EE velocity goals are per-message displacements, so pending ones are summed rather than
+                # replaced. Hiro velocities are proportional errors against the current state and stay latest-wins.
+                'velocity': merge_vel_goals,
+            })
+            self.solver_worker.start()
+            rospy.on_shutdown(self.solver_worker.stop)
+
+        # Pose goals are interpolated and velocity goals spread out between inputs
+        self.pose_interpolator = None
+        self.vel_spreader = None
+        if self.solve_rate > 0:
+            self.pose_interpolator = PoseGoalInterpolator(self.robot.num_chain,
+                                                          self.interpolation_delay, self.max_extrapolation)
+            self.vel_spreader = VelocityGoalSpreader(self.robot.num_chain)
+            self.last_input_kind = None
+            self.last_tick = None
+            self.solve_timer = rospy.Timer(rospy.Duration(1.0 / self.solve_rate), self.fixed_rate_cb)
+
         # Subscribers
-        rospy.Subscriber('/relaxed_ik/ee_pose_goals', EEPoseGoals, self.pose_goals_cb)
-        rospy.Subscriber('/relaxed_ik/ee_vel_goals', EEVelGoals, self.pose_vels_cb)
-        rospy.Subscriber('/relaxed_ik/hiro_ee_vel_goals', Float64MultiArray, self.hiro_pose_vels_cb)
-        rospy.Subscriber('/relaxed_ik/reset', JointState, self.reset_cb)
+        rospy.Subscriber(self.ns_name('/relaxed_ik/ee_pose_goals'), EEPoseGoals, self.pose_goals_cb)
+        rospy.Subscriber(self.ns_name('/relaxed_ik/ee_pose_goal_updates'), EEPoseGoalUpdate, self.pose_goal_update_cb)
+        rospy.Subscriber(self.ns_name('/relaxed_ik/ee_vel_goals'), EEVelGoals, self.pose_vels_cb)
+        rospy.Subscriber(self.ns_name('/relaxed_ik/hiro_ee_vel_goals'), Float64MultiArray, self.hiro_pose_vels_cb)
+        rospy.Subscriber(self.ns_name('/relaxed_ik/hiro_vel_goal'), HiroVelGoal, self.hiro_vel_goal_cb)
+        rospy.Subscriber(self.ns_name('/relaxed_ik/reset'), JointState, self.reset_cb)
+
+        # Asynchronous counterpart of solve_pose; a new goal preempts the one in flight
+        self.solve_pose_server = actionlib.SimpleActionServer(self.ns_name('relaxed_ik/solve_pose_action'), SolvePoseAction,
+                                                              execute_cb=self.execute_solve_pose, auto_start=False)
+        self.solve_pose_server.start()
+
+        if len(self.diagnostic_sources) > 0 and self.diagnostics_rate > 0:
+            self.diagnostics_pub = rospy.Publisher(self.ns_name('relaxed_ik/diagnostics'), DiagnosticArray, queue_size=1)
+            self.diagnostics_timer = rospy.Timer(rospy.Duration(1.0 / self.diagnostics_rate), self.diagnostics_cb)
+
+        self.startup_phase(startup_phases, 'ros interfaces', phase_start)
+        rospy.loginfo("Startup took {:.1f} ms: {}".format(sum(ms for _, ms in startup_phases),
+                      ', '.join('{} {:.1f} ms'.format(name, ms) for name, ms in startup_phases)))
 
         print("\nSolver RelaxedIK initialized!\n")
 
+    def startup_phase(self, phases, name, start):
+        now = time.perf_counter()
+        phases.append((name, (now - start) * 1000.0))
+        return now
+
+    def param_name(self, name):
+        # A namespaced robot's own ~<namespace>/<name> overrides the node-wide ~<name>
+        if self.namespace != '':
+            own = '~' + self.namespace + '/' + name
+            if rospy.has_param(own):
+                return own
+        return '~' + name
+
+    def ns_name(self, name):
+        if self.namespace == '':
+            return name
+        if name.startswith('/'):
+            return '/' + self.namespace + name
+        return self.namespace + '/' + name
+
     def get_ee_pose(self):
         ee_poses = self.relaxed_ik.get_ee_positions()
         ee_poses = np.array(ee_poses)
@@ -96,119 +494,318 @@ class RelaxedIK:
         return ee_poses
 
     def handle_ik_pose(self, req):
-        positions = []
-        orientations = []
-        tolerances = []
-        for i in range(len(req.ee_poses)):
-            positions.append(req.ee_poses[i].position.x)
-            positions.append(req.ee_poses[i].position.y)
-            positions.append(req.ee_poses[i].position.z)
-            orientations.append(req.ee_poses[i].orientation.x)
-            orientations.append(req.ee_poses[i].orientation.y)
-            orientations.append(req.ee_poses[i].orientation.z)
-            orientations.append(req.ee_poses[i].orientation.w)
-            if i < len(req.tolerances):
-                tolerances.append(req.tolerances[i].linear.x)
-                tolerances.append(req.tolerances[i].linear.y)
-                tolerances.append(req.tolerances[i].linear.z)
-                tolerances.append(req.tolerances[i].angular.x)
-                tolerances.append(req.tolerances[i].angular.y)
-                tolerances.append(req.tolerances[i].angular.z)
-            else:
-                for j in range(6):
-                    tolerances.append(0.0)
-
         if self.use_visualization:
             vis_msg = EEPoseGoals()
             vis_msg.ee_poses = req.ee_poses
             vis_msg.tolerances = req.tolerances
             self.vis_ee_pub.publish(vis_msg)
 
-        ik_solution = self.relaxed_ik.solve_position(positions, orientations, tolerances)
+        with self.solver_lock:
+            t_start = time.time()
+            t = self.stage_timer.start()
+            self.goal_buffers.pack_poses(req.ee_poses, req.tolerances)
+            t = self.stage_timer.record('unpack', t)
+            ik_solution = self.solve_packed_pose()
+            t = self.stage_timer.record('solve', t)
+            self.publish_solution(ik_solution, t)
+            self.record_pose_solve(t_start)
+            joint_state = ik_solution.tolist()
 
-        self.js_msg.header.stamp = rospy.Time.now()
-        self.js_msg.position = ik_solution
-        self.angles_pub.publish(self.js_msg)
         res = IKPoseResponse()
-        res.joint_state = ik_solution
+        res.joint_state = joint_state
 
         return res
 
-    def reset_cb(self, msg):
-        n = len(msg.positions)
-        x = (ctypes.c_double * n)()
-        for i in range(n):
-            x[i] = msg.positions[i]
-        self.relaxed_ik.reset(x, n)
+    def execute_solve_pose(self, goal):
+        # Runs on the action server thread. The solver lock is released between
+        # iterations so topic goals and preemption are not held up.
+        feedback = SolvePoseFeedback()
+        result = SolvePoseResult()
+        if not self.pose_goal_reachable(range(len(goal.ee_poses)), goal.ee_poses):
+            self.solve_pose_server.set_aborted(result, "Goal is outside the reachability map")
+            return
+
+        previous = None
+        for i in range(max(goal.max_iterations, 1)):
+            if self.solve_pose_server.is_preempt_requested() or rospy.is_shutdown():
+                result.joint_state = feedback.joint_state
+                result.iterations = i
+                self.solve_pose_server.set_preempted(result)
+                return
+
+            with self.solver_lock:
+                t_start = time.time()
+                t = self.stage_timer.start()
+                self.goal_buffers.pack_poses(goal.ee_poses, goal.tolerances)
+                t = self.stage_timer.record('unpack', t)
+                ik_solution = self.solve_packed_pose()
+                t = self.stage_timer.record('solve', t)
+                self.publish_solution(ik_solution, t)
+                self.record_pose_solve(t_start)
+                current = self.last_solution.copy()
+
+            feedback.joint_state = current.tolist()
+            feedback.iteration = i + 1
+            self.solve_pose_server.publish_feedback(feedback)
+
+            if previous is not None and np.max(np.abs(current - previous)) <= goal.convergence_threshold:
+                break
+            previous = current
+
+        result.joint_state = feedback.joint_state
+        result.iterations = feedback.iteration
+        self.solve_pose_server.set_succeeded(result)
+
+    def handle_ik_pose_batch(self, req):
+        positions, orientations, tolerances = pack_pose_batch(req.goals, self.robot.num_chain)
+        solutions = self.solve_pose_batch(positions, orientations, tolerances)
+
+        res = IKPoseBatchResponse()
+        res.joint_states = solutions.ravel().tolist()
+        res.num_joints = solutions.shape[1]
+        return res
 
-    def pose_goals_cb(self, msg):
-        positions = []
-        orientations = []
-        tolerances = []
-        for i in range(len(msg.ee_poses)):
-            positions.append(msg.ee_poses[i].position.x)
-            positions.append(msg.ee_poses[i].position.y)
-            positions.append(msg.ee_poses[i].position.z)
-            orientations.append(msg.ee_poses[i].orientation.x)
-            orientations.append(msg.ee_poses[i].orientation.y)
-            orientations.append(msg.ee_poses[i].orientation.z)
-            orientations.append(msg.ee_poses[i].orientation.w)
-            if i < len(msg.tolerances):
-                tolerances.append(msg.tolerances[i].linear.x)
-                tolerances.append(msg.tolerances[i].linear.y)
-                tolerances.append(msg.tolerances[i].linear.z)
-                tolerances.append(msg.tolerances[i].angular.x)
-                tolerances.append(msg.tolerances[i].angular.y)
-                tolerances.append(msg.tolerances[i].angular.z)
-            else:
-                for j in range(6):
-                    tolerances.append(0.0)
-
-        ik_solution = self.relaxed_ik.solve_position(positions, orientations, tolerances)
+    def solve_pose_batch(self, positions, orientations, tolerances):
+        """
+        Solve N goal sets in one go. Each row of the inputs is a flattened goal set
+        and each solve is warm-started from the previous one. The solver is reset to
+        the last published solution afterwards, so the live output is not disturbed.
+        Returns an (N, num_joints) array.
+        """
+        num_joints = len(self.robot.articulated_joint_names)
+        solutions = np.zeros((len(positions), num_joints))
+        if len(positions) == 0:
+            return solutions
+        # Held for the whole batch, so no topic solve or reset can break the warm-start chain
+        with self.solver_lock:
+            b = self.goal_buffers
+            if b.num_chain != positions.shape[1] // 3:
+                b.resize(positions.shape[1] // 3)
+            for k in range(len(positions)):
+                b.positions[:] = positions[k]
+                b.orientations[:] = orientations[k]
+                b.tolerances[:] = tolerances[k]
+                solutions[k] = self.solver.solve_position(b)
+
+            self.solver.reset(self.last_solution)
+            if self.goal_skipper is not None:
+                self.goal_skipper.invalidate()
+
+        return solutions
+
+    def solve_packed_pose(self):
+        # Solve the pose goal in goal_buffers, going through the solution cache and multi-start if enabled
+        b = self.goal_buffers
+        key = None
+        if self.solution_cache is not None:
+            key = self.solution_cache.key(b.positions, b.orientations, b.tolerances, self.last_solution)
+            cached = self.solution_cache.lookup(key)
+            if cached is not None:
+                self.solver.reset(cached)
+                if self.solution_cache_mode != 'warm_start':
+                    return cached
+
+        ik_solution = self.solver.solve_position(b)
+        if self.multi_start is not None:
+            best = self.multi_start.solve(b, ik_solution)
+            if best is not ik_solution:
+                # Carry on from the better solution
+                self.solver.reset(best)
+                ik_solution = self.solver.store(best)
+
+        if key is not None:
+            self.solution_cache.store(key, ik_solution)
+        return ik_solution
 
+    def reset_cb(self, msg):
+        with self.solver_lock:
+            t_start = time.time()
+            self.solver.reset(msg.position)
+            # Batch solves restore, and the solution cache is seeded from, the last solution
+            if len(msg.position) == len(self.last_solution):
+                self.last_solution[:] = msg.position
+            if self.goal_skipper is not None:
+                self.goal_skipper.invalidate()
+            if self.solve_log is not None:
+                self.solve_log.append('reset', [msg.position], [], t_start, time.time())
+
+    def record_pose_solve(self, t_start):
+        # Hand the goal in goal_buffers and the published solution to the log and quality monitor
+        b = self.goal_buffers
+        if self.solve_log is not None:
+            self.solve_log.append('pose', [b.positions, b.orientations, b.tolerances],
+                                  self.last_solution, t_start, time.time())
+        if self.quality_monitor is not None:
+            self.quality_monitor.submit(self.last_solution, b.positions, b.orientations, b.tolerances)
+        if self.goal_skipper is not None:
+            self.goal_skipper.solved('pose', b, self.last_solution)
+
+    def record_velocity_solve(self, t_start):
+        b = self.goal_buffers
+        if self.solve_log is not None:
+            self.solve_log.append('velocity', [b.linear_vels, b.angular_vels, b.tolerances],
+                                  self.last_solution, t_start, time.time())
+        if self.quality_monitor is not None:
+            self.quality_monitor.submit(self.last_solution)
+        if self.goal_skipper is not None:
+            self.goal_skipper.solved('velocity', b, self.last_solution)
+
+    def publish_solution(self, ik_solution, t):
         # Publish the joint angle solution
-        self.js_msg.header.stamp = rospy.Time.now()
-        self.js_msg.position = ik_solution
-        self.angles_pub.publish(self.js_msg)
+        self.last_solution[:] = ik_solution
+        if self.shared_solution is not None:
+            self.shared_solution.write(self.last_solution, rospy.get_time())
+        self.solution_pub.update(self.last_solution)
+        t = self.stage_timer.record('convert', t)
+        self.solution_pub.publish()
+        if self.trajectory_streamer is not None:
+            self.trajectory_streamer.update(self.last_solution, rospy.get_time())
+        self.stage_timer.record('publish', t)
+
+    def diagnostics_cb(self, event):
+        msg = DiagnosticArray()
+        msg.header.stamp = rospy.Time.now()
+        for source in self.diagnostic_sources:
+            msg.status.extend(source.diagnostic_status())
+        self.diagnostics_pub.publish(msg)
+
+    def solved_cb(self, kind, latency):
+        self.latency_pub.publish(Float64(latency))
+        self.dropped_goals_pub.publish(UInt64(self.solver_worker.total_dropped()))
+
+    def pose_goal_reachable(self, chain_indices, ee_poses):
+        # False if the goal should be dropped without solving
+        if self.reachability is None:
+            return True
+        missed = self.reachability.unreachable_chains(chain_indices, ee_poses)
+        if len(missed) == 0:
+            return True
+        if self.reachability_action == 'reject':
+            rospy.logwarn_throttle(1.0, "Dropping pose goal outside the reachability map for chains {}".format(missed))
+            return False
+        rospy.logwarn_throttle(1.0, "Pose goal outside the reachability map for chains {}".format(missed))
+        return True
 
-    def pose_vels_cb(self, msg):
-        linear_vels = []
-        angular_vels = []
-        tolerances = []
-        for i in range(len(msg.ee_vels)):
-            linear_vels.append(msg.ee_vels[i].linear.x)
-            linear_vels.append(msg.ee_vels[i].linear.y)
-            linear_vels.append(msg.ee_vels[i].linear.z)
-            angular_vels.append(msg.ee_vels[i].angular.x)
-            angular_vels.append(msg.ee_vels[i].angular.y)
-            angular_vels.append(msg.ee_vels[i].angular.z)
-            if i < len(msg.tolerances):
-                tolerances.append(msg.tolerances[i].linear.x)
-                tolerances.append(msg.tolerances[i].linear.y)
-                tolerances.append(msg.tolerances[i].linear.z)
-                tolerances.append(msg.tolerances[i].angular.x)
-                tolerances.append(msg.tolerances[i].angular.y)
-                tolerances.append(msg.tolerances[i].angular.z)
-            else:
-                for j in range(6):
-                    tolerances.append(0.0)
-
-        ik_solution = self.relaxed_ik.solve_velocity(linear_vels, angular_vels, tolerances)
-
-        assert len(ik_solution) == len(self.robot.articulated_joint_names)
+    def pose_goals_cb(self, msg):
+        if not self.pose_goal_reachable(range(len(msg.ee_poses)), msg.ee_poses):
+            return
+        with self.pose_goal_lock:
+            t = self.stage_timer.start()
+            self.pose_goal.pack_poses(msg.ee_poses, msg.tolerances)
+            self.stage_timer.record('unpack', t)
+        self.pose_goal_changed()
+
+    def pose_goal_update_cb(self, msg):
+        num_chain = self.pose_goal.num_chain
+        if len(msg.ee_poses) != len(msg.chain_indices) or len(msg.tolerances) not in (0, len(msg.chain_indices)) \
+                or any(i >= num_chain for i in msg.chain_indices):
+            rospy.logwarn_throttle(1.0, "Dropping malformed pose goal update for chains {}".format(list(msg.chain_indices)))
+            return
+        if not self.pose_goal_reachable(msg.chain_indices, msg.ee_poses):
+            return
+
+        with self.pose_goal_lock:
+            t = self.stage_timer.start()
+            self.pose_goal.pack_pose_update(msg.chain_indices, msg.ee_poses, msg.tolerances)
+            self.stage_timer.record('unpack', t)
+        self.pose_goal_changed()
+
+    def pose_goal_changed(self):
+        if self.pose_interpolator is not None:
+            with self.pose_goal_lock:
+                self.pose_interpolator.add_buffers(self.pose_goal, time.perf_counter())
+            self.last_input_kind = 'pose'
+        elif self.solver_worker is not None:
+            self.solver_worker.post('pose', self.pose_goal)
+        else:
+            self.solve_pose_goals(self.pose_goal)
 
-        # Publish the joint angle solution
-        self.js_msg.header.stamp = rospy.Time.now()
-        self.js_msg.position = ik_solution
-        self.angles_pub.publish(self.js_msg)
+    def pose_vels_cb(self, msg):
+        if self.vel_spreader is not None:
+            self.vel_spreader.add(msg.ee_vels, msg.tolerances, time.perf_counter())
+            self.last_input_kind = 'velocity'
+        elif self.solver_worker is not None:
+            self.solver_worker.post('velocity', msg)
+        else:
+            self.solve_pose_vels(msg)
 
     def hiro_pose_vels_cb(self, msg):
-        quat_goal = []
+        if self.solver_worker is not None:
+            self.solver_worker.post('hiro_velocity', msg)
+        else:
+            self.solve_hiro_pose_vels(msg)
+
+    def hiro_vel_goal_cb(self, msg):
+        if self.solver_worker is not None:
+            self.solver_worker.post('hiro_vel_goal', msg)
+        else:
+            self.solve_hiro_vel_goal(msg)
+
+    def fixed_rate_cb(self, event):
+        now = time.perf_counter()
+        dt = 1.0 / self.solve_rate if self.last_tick is None else now - self.last_tick
+        self.last_tick = now
+
+        with self.solver_lock:
+            t_start = time.time()
+            t = self.stage_timer.start()
+            b = self.goal_buffers
+            if self.last_input_kind == 'pose' and self.pose_interpolator.sample(now, b):
+                t = self.stage_timer.record('unpack', t)
+                if self.goal_skipper is not None and self.goal_skipper.skip_pose(b):
+                    self.publish_solution(self.last_solution, t)
+                    return
+                ik_solution = self.solve_packed_pose()
+                t = self.stage_timer.record('solve', t)
+                self.publish_solution(ik_solution, t)
+                self.record_pose_solve(t_start)
+            elif self.last_input_kind == 'velocity' and self.vel_spreader.sample(dt, b):
+                t = self.stage_timer.record('unpack', t)
+                if self.goal_skipper is not None and self.goal_skipper.skip_velocity(b):
+                    self.publish_solution(self.last_solution, t)
+                    return
+                ik_solution = self.solver.solve_velocity(b)
+                t = self.stage_timer.record('solve', t)
+                self.publish_solution(ik_solution, t)
+                self.record_velocity_solve(t_start)
+
+    def solve_pose_goals(self, pose_goal):
+        with self.solver_lock:
+            t_start = time.time()
+            with self.pose_goal_lock:
+                self.goal_buffers.copy_poses_from(pose_goal)
+            # The message was unpacked, and timed, in its callback
+            t = self.stage_timer.start()
+            if self.goal_skipper is not None and self.goal_skipper.skip_pose(self.goal_buffers):
+                self.publish_solution(self.last_solution, t)
+                return
+            ik_solution = self.solve_packed_pose()
+            t = self.stage_timer.record('solve', t)
+            self.publish_solution(ik_solution, t)
+            self.record_pose_solve(t_start)
+
+    def solve_pose_vels(self, msg):
+        with self.solver_lock:
+            t_start = time.time()
+            t = self.stage_timer.start()
+            self.goal_buffers.pack_twists(msg.ee_vels, msg.tolerances)
+            t = self.stage_timer.record('unpack', t)
+            if self.goal_skipper is not None and self.goal_skipper.skip_velocity(self.goal_buffers):
+                self.publish_solution(self.last_solution, t)
+                return
+            ik_solution = self.solver.solve_velocity(self.goal_buffers)
+            t = self.stage_timer.record('solve', t)
+            self.publish_solution(ik_solution, t)
+            self.record_velocity_solve(t_start)
+
+    def solve_hiro_pose_vels(self, msg):
+        t = self.stage_timer.start()
+        if len(msg.data) < 20 or (len(msg.data) - 20) % 3 != 0:
+            rospy.logwarn_throttle(1.0, "Dropping malformed hiro velocity goal with {} values".format(len(msg.data)))
+            return
+
         linear_vels = msg.data[:3]
         quat_goal = msg.data[3:7]
-        tolerances = []
-        for j in range(6):
-            tolerances.append(0.0)
         quat_line = msg.data[7:10]
         cone_params = msg.data[10:14]
         x_a = msg.data[14:17]
@@ -218,14 +815,44 @@ class RelaxedIK:
         x_history = msg.data[20:(20+history_len)]
         y_history = msg.data[(20+history_len):(20+history_len*2)]
         z_history = msg.data[(20+history_len*2):]
-
-        ik_solution = self.relaxed_ik.hiro_solve_velocity(linear_vels, quat_goal, tolerances, quat_line, cone_params, x_a, x_g, x_history, y_history, z_history)
-
-        assert len(ik_solution) == len(self.robot.articulated_joint_names)
-        # print(ik_solution)
-        self.js_msg.header.stamp = rospy.Time.now()
-        self.js_msg.position = ik_solution
-        self.angles_pub.publish(self.js_msg)
+        self.stage_timer.record('unpack', t)
+
+        self.solve_hiro(linear_vels, quat_goal, quat_line, cone_params, x_a, x_g, x_history, y_history, z_history)
+
+    def solve_hiro_vel_goal(self, msg):
+        t = self.stage_timer.start()
+        capacity = HiroVelGoal.HISTORY_CAPACITY
+        if msg.history_len > capacity or (msg.history_len > 0 and msg.history_start >= capacity):
+            rospy.logwarn_throttle(1.0, "Dropping hiro velocity goal with invalid history (start {}, length {})".format(
+                                        msg.history_start, msg.history_len))
+            return
+
+        # Unroll the ring buffer so the oldest sample comes first
+        idx = (self.hiro_history_index[:msg.history_len] + msg.history_start) % capacity
+        x_history = np.take(msg.x_history, idx)
+        y_history = np.take(msg.y_history, idx)
+        z_history = np.take(msg.z_history, idx)
+        self.stage_timer.record('unpack', t)
+
+        self.solve_hiro(msg.linear_vel, msg.quat_goal, msg.quat_line, msg.cone_params,
+                        msg.x_a, msg.x_g, x_history, y_history, z_history)
+
+    def solve_hiro(self, linear_vels, quat_goal, quat_line, cone_params, x_a, x_g, x_history, y_history, z_history):
+        with self.solver_lock:
+            t_start = time.time()
+            t = self.stage_timer.start()
+            ik_solution = self.solver.hiro_solve_velocity(linear_vels, quat_goal, self.hiro_tolerances, quat_line,
+                                                          cone_params, x_a, x_g, x_history, y_history, z_history)
+            t = self.stage_timer.record('solve', t)
+            self.publish_solution(ik_solution, t)
+            if self.solve_log is not None:
+                self.solve_log.append('hiro_velocity', [linear_vels, quat_goal, quat_line, cone_params, x_a, x_g,
+                                                        x_history, y_history, z_history],
+                                      self.last_solution, t_start, time.time())
+            if self.quality_monitor is not None:
+                self.quality_monitor.submit(self.last_solution)
+            if self.goal_skipper is not None:
+                self.goal_skipper.invalidate()
 
 if __name__ == '__main__':
     rospy.init_node('relaxed_ik')
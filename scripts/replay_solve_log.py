@@ -0,0 +1,90 @@
+#! /usr/bin/env python3
+
+'''
+Feeds a solve log recorded by the RelaxedIK node (~solve_log_path) back
+through RelaxedIKRust as fast as possible, without ROS. Reports the replay
+latency per goal type and how far the replayed solutions are from the
+recorded ones.
+
+Usage: replay_solve_log.py LOG [--settings SETTINGS_FILE]
+'''
+
+import argparse
+import numpy as np
+import os
+import rospkg
+import sys
+import time
+
+from goal_buffers import GoalBuffers
+from solve_log import SolveLogReader
+from solver_buffers import SolverBuffers
+
+path_to_src = rospkg.RosPack().get_path('relaxed_ik_ros1') + '/relaxed_ik_core'
+sys.path.insert(1, path_to_src + '/wrappers')
+import python_wrapper
+from python_wrapper import RelaxedIKRust
+
+def replay(reader, solver, buffers):
+    latencies = {}
+    deviations = {}
+    for kind, goal, solution, t_start, t_end in reader:
+        start = time.perf_counter()
+        if kind == 'pose':
+            c = len(goal) // 13
+            if buffers.num_chain != c:
+                buffers.resize(c)
+            buffers.positions[:] = goal[:3*c]
+            buffers.orientations[:] = goal[3*c:7*c]
+            buffers.tolerances[:] = goal[7*c:]
+            ik_solution = solver.solve_position(buffers)
+        elif kind == 'velocity':
+            c = len(goal) // 12
+            if buffers.num_chain != c:
+                buffers.resize(c)
+            buffers.linear_vels[:] = goal[:3*c]
+            buffers.angular_vels[:] = goal[3*c:6*c]
+            buffers.tolerances[:] = goal[6*c:]
+            ik_solution = solver.solve_velocity(buffers)
+        elif kind == 'hiro_velocity':
+            n = (len(goal) - 20) // 3
+            ik_solution = solver.hiro_solve_velocity(goal[:3], goal[3:7], np.zeros(6), goal[7:10], goal[10:14],
+                                                     goal[14:17], goal[17:20], goal[20:20+n],
+                                                     goal[20+n:20+2*n], goal[20+2*n:])
+        else:
+            solver.reset(goal)
+            continue
+
+        latencies.setdefault(kind, []).append(time.perf_counter() - start)
+        deviations.setdefault(kind, []).append(np.max(np.abs(ik_solution - solution)))
+
+    return latencies, deviations
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a relaxed_ik solve log offline.')
+    parser.add_argument('log', help='solve log written by the RelaxedIK node')
+    parser.add_argument('--settings', default=path_to_src + '/configs/settings.yaml',
+                        help='settings file the log was recorded with')
+    args = parser.parse_args()
+
+    log_path = os.path.abspath(args.log)
+    setting_file_path = os.path.abspath(args.settings)
+    os.chdir(path_to_src)
+
+    reader = SolveLogReader(log_path)
+    relaxed_ik = RelaxedIKRust(setting_file_path)
+    solver = SolverBuffers(relaxed_ik, reader.num_joints, getattr(python_wrapper, 'lib', None))
+    buffers = GoalBuffers(reader.num_chain)
+
+    start = time.perf_counter()
+    latencies, deviations = replay(reader, solver, buffers)
+    total = time.perf_counter() - start
+
+    num_solves = sum(len(v) for v in latencies.values())
+    print("Replayed {} solves in {:.3f} s ({:.1f} solves/s)".format(num_solves, total, num_solves / total if total > 0 else 0.0))
+    for kind in latencies:
+        ms = np.array(latencies[kind]) * 1000.0
+        dev = np.array(deviations[kind])
+        print("{:>14}: {:6d} solves, latency mean {:.3f} ms, p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms; "
+              "max joint deviation {:.2e} rad".format(kind, len(ms), ms.mean(), np.percentile(ms, 50),
+                                                      np.percentile(ms, 99), ms.max(), dev.max()))
@@ -6,32 +6,78 @@ import rospkg
 import rospy
 import transformations as T
 
-from geometry_msgs.msg import Pose, Vector3
+from geometry_msgs.msg import Vector3
 from std_msgs.msg import Float32MultiArray, Bool, String
 from sensor_msgs.msg import JointState
 from timeit import default_timer as timer
 from urdf_parser_py.urdf import URDF
 import PyKDL
 from kdl_parser import kdl_tree_from_urdf_model
+from kinematics import ChainModel, matrix_to_quaternion, manipulability, condition_number
+from pose_adapter import pose_from_array, poses_from_array
+from robot_cache import default_cache_dir, robot_cache_path, load_robot_cache, save_robot_cache
 import yaml
 
 class Robot():
-    def __init__(self, setting_path = None):
+    def __init__(self, setting_path = None, settings = None, urdf_string = None, cache_dir = None):
+        # settings and urdf_string let a caller that already loaded them skip reading the files again.
+        # The model is cached under cache_dir (default: under ROS_HOME); '' disables the cache.
         path_to_src = rospkg.RosPack().get_path('relaxed_ik_ros1') + '/relaxed_ik_core'
         setting_file_path = path_to_src + '/configs/settings.yaml'
-        if setting_path != '':
+        if setting_path:
            setting_file_path = setting_path
         os.chdir(path_to_src)
 
         # Load the infomation
-        setting_file = open(setting_file_path, 'r')
-        settings = yaml.load(setting_file, Loader=yaml.FullLoader)
+        if settings is None:
+            setting_file = open(setting_file_path, 'r')
+            settings = yaml.load(setting_file, Loader=yaml.FullLoader)
 
         urdf_name = settings["urdf"]
         
-        self.robot = URDF.from_xml_file(path_to_src + "/configs/urdfs/" + urdf_name)
-        self.kdl_tree = kdl_tree_from_urdf_model(self.robot)
-        
+        if urdf_string is None:
+            urdf_file = open(path_to_src + "/configs/urdfs/" + urdf_name, 'r')
+            urdf_string = urdf_file.read()
+        self.urdf_string = urdf_string
+
+        assert len(settings['base_links']) == len(settings['ee_links']) 
+        self.num_chain = len(settings['base_links'])
+        self.base_links = settings['base_links']
+        self.ee_links = settings['ee_links']
+
+        # The URDF model, KDL tree and chains are only built when first used
+        self._robot = None
+        self._kdl_tree = None
+        self._arm_chains = None
+        self._fk_p_kdls = None
+
+        if cache_dir is None:
+            cache_dir = default_cache_dir()
+        cache_path = robot_cache_path(cache_dir, urdf_string, settings) if cache_dir != '' else None
+        if cache_path is None or not load_robot_cache(cache_path, self):
+            self.load_urdf_model()
+            if cache_path is not None:
+                try:
+                    save_robot_cache(cache_path, self)
+                except OSError as e:
+                    rospy.logwarn("Could not write the robot model cache {}: {}".format(cache_path, e))
+
+        # Reused by fk_array and fk_matrices, which therefore are not thread-safe
+        self.fk_jnt_arrays = [PyKDL.JntArray(n) for n in self.num_jnts]
+        self.fk_frames = [PyKDL.Frame() for _ in range(self.num_chain)]
+
+        if 'starting_config' in settings:
+            print('articulated joints:' ,len(self.articulated_joint_names))
+            print('starting config joints:' ,len(settings['starting_config']))
+            assert len(self.articulated_joint_names) == len(settings['starting_config']), \
+                        "Number of joints parsed from urdf should be the same with the starting config in the setting file."
+
+        # Velocity and IK solvers are only built when first used
+        self._fk_v_kdls = None
+        self._ik_v_kdls = None
+        self._ik_p_kdls = None
+
+    def load_urdf_model(self):
         # all non-fixed joint         
         self.joint_lower_limits = []
         self.joint_upper_limits = []
@@ -46,42 +92,62 @@ class Robot():
 
         # joints solved by relaxed ik
         self.articulated_joint_names = []
-        assert len(settings['base_links']) == len(settings['ee_links']) 
-        self.num_chain = len(settings['base_links'])
-
-        for i in range(self.num_chain):
-            arm_chain = self.kdl_tree.getChain( settings['base_links'][i],
-                                                settings['ee_links'][i])
+        self.num_jnts = []
+        for arm_chain in self.arm_chains:
             for j in range(arm_chain.getNrOfSegments()):
                 joint = arm_chain.getSegment(j).getJoint()
                 # 8 is fixed joint   
                 
                 if joint.getType() != 8:
                     self.articulated_joint_names.append(joint.getName())
+            self.num_jnts.append(arm_chain.getNrOfJoints())
 
-        if 'starting_config' in settings:
-            print('articulated joints:' ,len(self.articulated_joint_names))
-            print('starting config joints:' ,len(settings['starting_config']))
-            assert len(self.articulated_joint_names) == len(settings['starting_config']), \
-                        "Number of joints parsed from urdf should be the same with the starting config in the setting file."
+        # Fixed transforms and joint axes of every chain, for vectorized FK
+        self.chain_models = [ChainModel(c) for c in self.arm_chains]
 
-        self.arm_chains = []
-        self.fk_p_kdls = []
-        self.fk_v_kdls = []
-        self.ik_p_kdls = []
-        self.ik_v_kdls = []
-        self.num_jnts = []
-        for i in range(self.num_chain):
-            arm_chain = self.kdl_tree.getChain( settings['base_links'][i],
-                                                settings['ee_links'][i])
-            self.arm_chains.append(arm_chain)
-            self.fk_p_kdls.append(PyKDL.ChainFkSolverPos_recursive(arm_chain))
-            self.fk_v_kdls.append(PyKDL.ChainFkSolverVel_recursive(arm_chain))
-            self.ik_v_kdls.append(PyKDL.ChainIkSolverVel_pinv(arm_chain))
-            self.ik_p_kdls.append(PyKDL.ChainIkSolverPos_NR(arm_chain, 
-                                                            self.fk_p_kdls[i],
-                                                            self.ik_v_kdls[i]))
-            self.num_jnts.append(arm_chain.getNrOfJoints())
+    @property
+    def robot(self):
+        if self._robot is None:
+            self._robot = URDF.from_xml_string(self.urdf_string)
+        return self._robot
+
+    @property
+    def kdl_tree(self):
+        if self._kdl_tree is None:
+            self._kdl_tree = kdl_tree_from_urdf_model(self.robot)
+        return self._kdl_tree
+
+    @property
+    def arm_chains(self):
+        if self._arm_chains is None:
+            self._arm_chains = [self.kdl_tree.getChain(self.base_links[i], self.ee_links[i])
+                                for i in range(self.num_chain)]
+        return self._arm_chains
+
+    @property
+    def fk_p_kdls(self):
+        if self._fk_p_kdls is None:
+            self._fk_p_kdls = [PyKDL.ChainFkSolverPos_recursive(c) for c in self.arm_chains]
+        return self._fk_p_kdls
+
+    @property
+    def fk_v_kdls(self):
+        if self._fk_v_kdls is None:
+            self._fk_v_kdls = [PyKDL.ChainFkSolverVel_recursive(c) for c in self.arm_chains]
+        return self._fk_v_kdls
+
+    @property
+    def ik_v_kdls(self):
+        if self._ik_v_kdls is None:
+            self._ik_v_kdls = [PyKDL.ChainIkSolverVel_pinv(c) for c in self.arm_chains]
+        return self._ik_v_kdls
+
+    @property
+    def ik_p_kdls(self):
+        if self._ik_p_kdls is None:
+            self._ik_p_kdls = [PyKDL.ChainIkSolverPos_NR(c, self.fk_p_kdls[i], self.ik_v_kdls[i])
+                               for i, c in enumerate(self.arm_chains)]
+        return self._ik_p_kdls
 
     def fk_single_chain(self, fk_p_kdl, joint_angles, num_jnts):
         assert len(joint_angles) == num_jnts, "length of input: {}, number of joints: {}".format(len(joint_angles), num_jnts)
@@ -94,30 +160,122 @@ class Robot():
         fk_p_kdl.JntToCart(kdl_array, end_frame)
 
         pos = end_frame.p
-        rot = PyKDL.Rotation(end_frame.M)
-        rot = rot.GetQuaternion()
-        pose = Pose()
-        pose.position.x = pos[0]
-        pose.position.y = pos[1]
-        pose.position.z = pos[2]
-        pose.orientation.x = rot[0]
-        pose.orientation.y = rot[1]
-        pose.orientation.z = rot[2]
-        pose.orientation.w = rot[3]
-        return pose
+        rot = end_frame.M.GetQuaternion()
+        return pose_from_array((pos[0], pos[1], pos[2]) + tuple(rot))
 
-    def fk(self, joint_angles):
+    def fk_frame(self, i, joint_angles):
+        # End frame of chain i, computed into the chain's reused KDL buffers
+        num_jnts = self.num_jnts[i]
+        assert len(joint_angles) == num_jnts, "length of input: {}, number of joints: {}".format(len(joint_angles), num_jnts)
+
+        kdl_array = self.fk_jnt_arrays[i]
+        for idx in range(num_jnts):
+            kdl_array[idx] = joint_angles[idx]
+        self.fk_p_kdls[i].JntToCart(kdl_array, self.fk_frames[i])
+        return self.fk_frames[i]
+
+    def fk_array(self, joint_angles, out=None):
+        """End effector poses as a (num_chain, 7) array of x, y, z, qx, qy, qz, qw, filled into out if given."""
+        if out is None:
+            out = np.empty((self.num_chain, 7))
+        if self._arm_chains is None:
+            # The model came from the cache and KDL was never built, so stay on the NumPy path
+            self.fk_batch(np.reshape(joint_angles, (1, -1)), out=out[None])
+            return out
         l = 0
-        r = 0
-        poses = []
         for i in range(self.num_chain):
-            r += self.num_jnts[i]
-            pose = self.fk_single_chain(self.fk_p_kdls[i], joint_angles[l:r], self.num_jnts[i])
+            r = l + self.num_jnts[i]
+            frame = self.fk_frame(i, joint_angles[l:r])
+            l = r
+            p = frame.p
+            out[i, :3] = (p[0], p[1], p[2])
+            out[i, 3:] = frame.M.GetQuaternion()
+        return out
+
+    def fk_matrices(self, joint_angles, out=None):
+        """End effector poses as (num_chain, 4, 4) homogeneous matrices, filled into out if given."""
+        if out is None:
+            out = np.empty((self.num_chain, 4, 4))
+        if self._arm_chains is None:
+            q = np.reshape(np.asarray(joint_angles, dtype=float), (1, -1))
+            l = 0
+            for i, model in enumerate(self.chain_models):
+                r = l + self.num_jnts[i]
+                R, p = model.fk(q[:, l:r])
+                l = r
+                out[i, :3, :3] = R[0]
+                out[i, :3, 3] = p[0]
+                out[i, 3] = (0.0, 0.0, 0.0, 1.0)
+            return out
+        l = 0
+        for i in range(self.num_chain):
+            r = l + self.num_jnts[i]
+            frame = self.fk_frame(i, joint_angles[l:r])
+            l = r
+            M = frame.M
+            p = frame.p
+            for row in range(3):
+                out[i, row] = (M[row, 0], M[row, 1], M[row, 2], p[row])
+            out[i, 3] = (0.0, 0.0, 0.0, 1.0)
+        return out
+
+    def fk(self, joint_angles):
+        return poses_from_array(self.fk_array(joint_angles))
+
+    def fk_batch(self, joint_angles, out=None):
+        """
+        FK for many configurations at once: (N, num joints) joint angles in the
+        same order as fk -> (N, num_chain, 7) array of x, y, z, qx, qy, qz, qw,
+        filled into out if given.
+        """
+        q = np.atleast_2d(np.asarray(joint_angles, dtype=float))
+        poses = np.empty((len(q), self.num_chain, 7)) if out is None else out
+        l = 0
+        for i, model in enumerate(self.chain_models):
+            r = l + self.num_jnts[i]
+            R, p = model.fk(q[:, l:r])
+            poses[:, i, :3] = p
+            poses[:, i, 3:] = matrix_to_quaternion(R)
             l = r
-            poses.append(pose)
-        
         return poses
 
+    def chain_jacobians_batch(self, joint_angles):
+        """Per-chain geometric Jacobians: a list of (N, 6, num_jnts[i]) arrays."""
+        q = np.atleast_2d(np.asarray(joint_angles, dtype=float))
+        jacobians = []
+        l = 0
+        for i, model in enumerate(self.chain_models):
+            r = l + self.num_jnts[i]
+            jacobians.append(model.jacobian(q[:, l:r]))
+            l = r
+        return jacobians
+
+    def jacobian_batch(self, joint_angles):
+        """
+        Geometric Jacobians for many configurations, (N, 6 * num_chain, num joints).
+        Chains share no joints, so the result is block-diagonal: rows 6i to 6i+6
+        are chain i's linear and angular velocity at its end effector.
+        """
+        jacobians = self.chain_jacobians_batch(joint_angles)
+        J = np.zeros((len(jacobians[0]), 6 * self.num_chain, sum(self.num_jnts)))
+        l = 0
+        for i, Ji in enumerate(jacobians):
+            r = l + self.num_jnts[i]
+            J[:, 6*i:6*i+6, l:r] = Ji
+            l = r
+        return J
+
+    def jacobian(self, joint_angles):
+        return self.jacobian_batch(joint_angles)[0]
+
+    def manipulability(self, joint_angles):
+        """Manipulability of each chain, (N, num_chain); it drops to zero at singularities."""
+        return np.stack([manipulability(J) for J in self.chain_jacobians_batch(joint_angles)], axis=1)
+
+    def condition_number(self, joint_angles):
+        """Jacobian condition number of each chain, (N, num_chain); inf at singularities."""
+        return np.stack([condition_number(J) for J in self.chain_jacobians_batch(joint_angles)], axis=1)
+
     def get_joint_state_msg(self, joint_angles):
         js = JointState()
         js.header.stamp = rospy.Time.now()
@@ -0,0 +1,82 @@
+#! /usr/bin/env python3
+
+'''
+On-disk cache of the parts of Robot derived from the URDF: joint names and
+limits, the articulated joints of each chain and the ChainModel transforms
+and axes. Entries are .npz files named after a hash of the URDF text and the
+settings, so editing either simply misses the cache. Loading an entry takes a
+few milliseconds, where parsing the URDF and building the KDL tree does not.
+'''
+
+import hashlib
+import json
+import numpy as np
+import os
+import rospkg
+import zipfile
+
+from kinematics import ChainModel
+
+# Bump when the cached fields change
+CACHE_VERSION = 1
+
+CHAIN_FIELDS = ('rotational', 'origins', 'axes', 'R_pre', 'p_pre', 'R_post', 'p_post')
+
+def default_cache_dir():
+    return os.path.join(rospkg.get_ros_home(), 'relaxed_ik', 'robot_cache')
+
+def robot_cache_path(cache_dir, urdf_string, settings):
+    h = hashlib.sha256()
+    h.update(str(CACHE_VERSION).encode())
+    h.update(urdf_string.encode())
+    h.update(json.dumps(settings, sort_keys=True, default=str).encode())
+    return os.path.join(cache_dir, h.hexdigest()[:32] + '.npz')
+
+def _limits_array(limits):
+    # Joints without a limit are stored as nan
+    return np.array([np.nan if v is None else v for v in limits], dtype=float)
+
+def _limits_list(a):
+    return [None if np.isnan(v) else float(v) for v in a]
+
+def save_robot_cache(path, robot):
+    data = {
+        'version': np.int64(CACHE_VERSION),
+        'all_joint_names': np.array(robot.all_joint_names, dtype=str),
+        'joint_lower_limits': _limits_array(robot.joint_lower_limits),
+        'joint_upper_limits': _limits_array(robot.joint_upper_limits),
+        'joint_vel_limits': _limits_array(robot.joint_vel_limits),
+        'articulated_joint_names': np.array(robot.articulated_joint_names, dtype=str),
+        'num_jnts': np.array(robot.num_jnts, dtype=np.int64),
+    }
+    for i, model in enumerate(robot.chain_models):
+        for name, a in zip(CHAIN_FIELDS, model.arrays()):
+            data['{}_{}'.format(name, i)] = a
+
+    # Written under a temporary name first, so a concurrently starting node never reads half a file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **data)
+    os.replace(tmp_path, path)
+
+def load_robot_cache(path, robot):
+    """Fills in robot's model attributes from path; False if there is no usable entry."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['version']) != CACHE_VERSION:
+                return False
+            num_jnts = data['num_jnts'].tolist()
+            chain_models = [ChainModel.from_arrays(*[data['{}_{}'.format(name, i)] for name in CHAIN_FIELDS])
+                            for i in range(len(num_jnts))]
+            robot.all_joint_names = data['all_joint_names'].tolist()
+            robot.joint_lower_limits = _limits_list(data['joint_lower_limits'])
+            robot.joint_upper_limits = _limits_list(data['joint_upper_limits'])
+            robot.joint_vel_limits = _limits_list(data['joint_vel_limits'])
+            robot.articulated_joint_names = data['articulated_joint_names'].tolist()
+            robot.num_jnts = num_jnts
+            robot.chain_models = chain_models
+    except (OSError, KeyError, ValueError, EOFError, zipfile.BadZipFile):
+        # A truncated or corrupt entry is a miss; saving the fresh model replaces it
+        return False
+    return True
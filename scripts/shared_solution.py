@@ -0,0 +1,157 @@
+#! /usr/bin/env python3
+
+'''
+Shared-memory channel for joint solutions, for consumers on the same host.
+
+The segment holds a small header and a ring of slots. Each slot is a seqlock:
+the writer makes the slot's sequence odd, writes the stamp and positions, then
+stores the final even sequence and publishes the solution number in the
+header. Readers copy a slot and retry if its sequence was odd or changed
+meanwhile, so neither side ever takes a lock.
+'''
+
+import numpy as np
+import os
+import struct
+import time
+
+from multiprocessing import shared_memory, resource_tracker
+
+# magic, version, num_joints, number of slots, writer pid, number of the latest solution (0: none yet)
+_HEADER = struct.Struct('<4sIIIQQ')
+MAGIC = b'RIKS'
+VERSION = 2
+
+def _pid_alive(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _slot_size(num_joints):
+    # sequence (uint64), stamp (float64), positions (float64 each)
+    return 8 * (2 + num_joints)
+
+class SharedSolutionWriter:
+    def __init__(self, name, num_joints, num_slots=16):
+        self.num_joints = num_joints
+        self.num_slots = num_slots
+        size = _HEADER.size + num_slots * _slot_size(num_joints)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self.reclaim(name)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        self.slots = np.ndarray((num_slots, 2 + num_joints), dtype='<f8', buffer=self.shm.buf, offset=_HEADER.size)
+        self.slot_seqs = self.slots[:, 0].view('<u8')
+        self.latest = np.ndarray((1,), dtype='<u8', buffer=self.shm.buf, offset=_HEADER.size - 8)
+        self.slot_seqs[:] = 0
+        self.count = 0
+        _HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, num_joints, num_slots, os.getpid(), 0)
+
+    @staticmethod
+    def reclaim(name):
+        # Unlink a segment left behind by a writer that did not shut down cleanly.
+        # Anything that is not provably stale is left alone.
+        existing = shared_memory.SharedMemory(name=name)
+        try:
+            magic, version, _, _, pid, _ = _HEADER.unpack_from(existing.buf, 0)
+        except struct.error:
+            magic, version, pid = None, None, 0
+        if magic != MAGIC or version != VERSION:
+            existing.close()
+            raise FileExistsError("Shared memory segment {} exists and is not a relaxed_ik solution segment "
+                                  "of this version; remove it by hand if it is stale".format(name))
+        if _pid_alive(pid):
+            existing.close()
+            raise FileExistsError("Shared memory segment {} is in use by process {}".format(name, pid))
+        existing.close()
+        existing.unlink()
+
+    def write(self, joint_angles, stamp):
+        self.count += 1
+        i = self.count % self.num_slots
+        self.slot_seqs[i] = 2 * self.count - 1
+        self.slots[i, 1] = stamp
+        self.slots[i, 2:] = joint_angles
+        self.slot_seqs[i] = 2 * self.count
+        self.latest[0] = self.count
+
+    def close(self):
+        del self.slots, self.slot_seqs, self.latest
+        self.shm.close()
+        self.shm.unlink()
+
+class SharedSolutionReader:
+    """
+    Reads solutions written by SharedSolutionWriter. Solutions are numbered from
+    1 in the order they were written; read_latest returns (number, stamp,
+    positions) or None if nothing has been written yet.
+    """
+    def __init__(self, name):
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before Python 3.13 attaching registers the segment with the resource
+            # tracker, which would unlink it from under the writer when we exit
+            self.shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+
+        magic, version, self.num_joints, self.num_slots, self.writer_pid, _ = _HEADER.unpack_from(self.shm.buf, 0)
+        assert magic == MAGIC, "{} is not a relaxed_ik solution segment".format(name)
+        assert version == VERSION, "Unsupported solution segment version {}".format(version)
+
+        self.slots = np.ndarray((self.num_slots, 2 + self.num_joints), dtype='<f8', buffer=self.shm.buf,
+                                offset=_HEADER.size)
+        self.slot_seqs = self.slots[:, 0].view('<u8')
+        self.latest = np.ndarray((1,), dtype='<u8', buffer=self.shm.buf, offset=_HEADER.size - 8)
+        self.scratch = np.zeros(1 + self.num_joints)
+
+    def latest_number(self):
+        return int(self.latest[0])
+
+    def read(self, number, out=None):
+        """Solution number, or None once the ring has overwritten it."""
+        i = number % self.num_slots
+        while True:
+            seq = int(self.slot_seqs[i])
+            if seq == 2 * number - 1:
+                continue
+            if seq != 2 * number:
+                return None
+            self.scratch[:] = self.slots[i, 1:]
+            if int(self.slot_seqs[i]) == seq:
+                break
+
+        if out is None:
+            out = np.empty(self.num_joints)
+        out[:] = self.scratch[1:]
+        return number, float(self.scratch[0]), out
+
+    def read_latest(self, out=None):
+        while True:
+            number = self.latest_number()
+            if number == 0:
+                return None
+            solution = self.read(number, out)
+            if solution is not None:
+                return solution
+
+    def wait_for_next(self, number, timeout=1.0, poll_interval=1e-4, out=None):
+        # Poll until a solution newer than number shows up; returns None on timeout
+        deadline = time.perf_counter() + timeout
+        while self.latest_number() <= number:
+            if time.perf_counter() > deadline:
+                return None
+            time.sleep(poll_interval)
+        return self.read_latest(out)
+
+    def close(self):
+        del self.slots, self.slot_seqs, self.latest
+        self.shm.close()
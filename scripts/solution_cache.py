@@ -0,0 +1,67 @@
+#! /usr/bin/env python3
+
+import numpy as np
+import threading
+
+from collections import OrderedDict
+from diagnostic_msgs.msg import DiagnosticStatus, KeyValue
+
+class SolutionCache:
+    """
+    LRU cache of pose solutions. Keys are the goal positions, orientations and
+    tolerances plus the seed configuration, each rounded to a grid step, so goals
+    that repeat up to the step size map to the same entry.
+    """
+    def __init__(self, capacity=1024, position_step=1e-4, orientation_step=1e-3,
+                 tolerance_step=1e-3, seed_step=1e-2):
+        self.capacity = capacity
+        self.position_step = position_step
+        self.orientation_step = orientation_step
+        self.tolerance_step = tolerance_step
+        self.seed_step = seed_step
+
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, positions, orientations, tolerances, seed):
+        # q and -q are the same rotation, so quantize the one with w >= 0
+        quats = np.reshape(orientations, (-1, 4))
+        quats = np.where(quats[:, 3:4] < 0.0, -quats, quats)
+        parts = [np.round(np.asarray(positions) / self.position_step),
+                 np.round(quats / self.orientation_step),
+                 np.round(np.asarray(tolerances) / self.tolerance_step),
+                 np.round(np.asarray(seed) / self.seed_step)]
+        return b''.join(part.astype(np.int64).tobytes() for part in parts)
+
+    def lookup(self, key):
+        with self.lock:
+            solution = self.entries.get(key)
+            if solution is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return solution
+
+    def store(self, key, solution):
+        with self.lock:
+            self.entries[key] = np.array(solution, dtype=float)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def diagnostic_status(self):
+        with self.lock:
+            hits, misses, size = self.hits, self.misses, len(self.entries)
+        total = hits + misses
+        status = DiagnosticStatus()
+        status.level = DiagnosticStatus.OK
+        status.name = 'relaxed_ik: solution cache'
+        status.message = '{:.1f}% hit rate'.format(100.0 * hits / total if total > 0 else 0.0)
+        status.values = [KeyValue('hits', str(hits)),
+                         KeyValue('misses', str(misses)),
+                         KeyValue('entries', str(size)),
+                         KeyValue('capacity', str(self.capacity))]
+        return [status]
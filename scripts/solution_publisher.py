@@ -0,0 +1,91 @@
+#! /usr/bin/env python3
+
+import numpy as np
+import rospy
+import struct
+
+from sensor_msgs.msg import JointState
+from std_msgs.msg import Float64MultiArray
+
+_struct_I = struct.Struct('<I')
+_struct_3I = struct.Struct('<3I')
+
+def _pack_string(s):
+    b = s.encode('utf-8')
+    return _struct_I.pack(len(b)) + b
+
+class PreSerializedJointState(JointState):
+    """
+    JointState whose wire format is kept in one reused buffer. The header
+    prefix and joint names are serialized once; each update only writes the
+    stamp and positions in place. Velocity and effort are always empty.
+    """
+    __slots__ = ['buffer', 'stamp_secs', 'stamp_nsecs']
+
+    def __init__(self, joint_names, frame_id=''):
+        super(PreSerializedJointState, self).__init__()
+        self.name = list(joint_names)
+        self.header.frame_id = frame_id
+        self.stamp_secs = 0
+        self.stamp_nsecs = 0
+
+        n = len(self.name)
+        prefix = bytearray(12) + _pack_string(frame_id)
+        prefix += _struct_I.pack(n) + b''.join(_pack_string(name) for name in self.name)
+        prefix += _struct_I.pack(n)
+        pos_offset = len(prefix)
+        self.buffer = prefix + bytearray(8 * n) + _struct_I.pack(0) + _struct_I.pack(0)
+
+        # position is a view into the serialized buffer
+        self.position = np.frombuffer(self.buffer, dtype='<f8', count=n, offset=pos_offset)
+
+    def update(self, joint_angles, stamp):
+        self.position[:] = joint_angles
+        self.stamp_secs = int(stamp)
+        self.stamp_nsecs = int((stamp - self.stamp_secs) * 1e9)
+
+    def serialize(self, buff):
+        # rospy assigns header.seq right before calling serialize
+        _struct_3I.pack_into(self.buffer, 0, self.header.seq, self.stamp_secs, self.stamp_nsecs)
+        buff.write(self.buffer)
+
+class PreSerializedFloat64Array(Float64MultiArray):
+    """Float64MultiArray with an empty layout, serialized into one reused buffer."""
+    __slots__ = ['buffer']
+
+    def __init__(self, n):
+        super(PreSerializedFloat64Array, self).__init__()
+        # layout.dim (empty), layout.data_offset, then the data length prefix
+        prefix = _struct_I.pack(0) + _struct_I.pack(0) + _struct_I.pack(n)
+        self.buffer = bytearray(prefix) + bytearray(8 * n)
+        self.data = np.frombuffer(self.buffer, dtype='<f8', count=n, offset=len(prefix))
+
+    def update(self, values):
+        self.data[:] = values
+
+    def serialize(self, buff):
+        buff.write(self.buffer)
+
+class SolutionPublisher:
+    """
+    Publishes joint solutions as JointState, plus an optional positions-only
+    Float64MultiArray, without allocating a new message or name list per solve.
+    """
+    def __init__(self, topic, joint_names, compact_topic=None):
+        self.js_msg = PreSerializedJointState(joint_names)
+        self.pub = rospy.Publisher(topic, JointState, queue_size=1)
+
+        self.compact_msg = None
+        if compact_topic is not None:
+            self.compact_msg = PreSerializedFloat64Array(len(joint_names))
+            self.compact_pub = rospy.Publisher(compact_topic, Float64MultiArray, queue_size=1)
+
+    def update(self, joint_angles):
+        self.js_msg.update(joint_angles, rospy.get_time())
+        if self.compact_msg is not None:
+            self.compact_msg.update(joint_angles)
+
+    def publish(self):
+        self.pub.publish(self.js_msg)
+        if self.compact_msg is not None:
+            self.compact_pub.publish(self.compact_msg)
@@ -0,0 +1,120 @@
+#! /usr/bin/env python3
+
+import fcntl
+import mmap
+import numpy as np
+import struct
+import threading
+
+# File header: magic, version, num_chain, num_joints, end offset of the last complete record
+_HEADER = struct.Struct('<8sIIIxxxxQ')
+# Record header: kind, goal length, solution length, solve start and end time (time.time())
+_RECORD = struct.Struct('<BxxxIIxxxxdd')
+
+MAGIC = b'RIKLOG\x00\x00'
+VERSION = 1
+
+# Goal layouts, all float64:
+#   pose:          positions (3 per chain), orientations (4 per chain, xyzw), tolerances (6 per chain)
+#   velocity:      linear vels (3 per chain), angular vels (3 per chain), tolerances (6 per chain)
+#   hiro_velocity: same layout as the relaxed_ik/hiro_ee_vel_goals Float64MultiArray
+#   reset:         joint angles, with an empty solution
+KINDS = ['pose', 'velocity', 'hiro_velocity', 'reset']
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+class SolveLogWriter:
+    """
+    Append-only, memory-mapped log of solver goals and solutions. Values are
+    written straight into the mapping; the file grows by doubling when full and
+    is truncated to its used length on close.
+    """
+    def __init__(self, path, num_chain, num_joints, capacity=64 * 1024 * 1024):
+        self.path = path
+        self.num_chain = num_chain
+        self.num_joints = num_joints
+        self.lock = threading.Lock()
+
+        # Opened without truncating, so a log another writer holds is not clobbered before the lock check
+        self.file = open(path, 'a+b')
+        try:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            raise RuntimeError("Solve log {} is already being written by another writer".format(path))
+        self.file.truncate(0)
+        self.capacity = max(capacity, _HEADER.size + _RECORD.size)
+        self.file.truncate(self.capacity)
+        self.mm = mmap.mmap(self.file.fileno(), self.capacity)
+        self.end = _HEADER.size
+        self.write_header()
+
+    def write_header(self):
+        _HEADER.pack_into(self.mm, 0, MAGIC, VERSION, self.num_chain, self.num_joints, self.end)
+
+    def grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        self.mm.close()
+        self.file.truncate(capacity)
+        self.mm = mmap.mmap(self.file.fileno(), capacity)
+        self.capacity = capacity
+
+    def append(self, kind, goal_parts, solution, t_start, t_end):
+        goal_len = sum(len(part) for part in goal_parts)
+        solution_len = len(solution)
+        with self.lock:
+            if self.mm is None:
+                return
+            size = _RECORD.size + 8 * (goal_len + solution_len)
+            if self.end + size > self.capacity:
+                self.grow(self.end + size)
+
+            _RECORD.pack_into(self.mm, self.end, KIND_CODES[kind], goal_len, solution_len, t_start, t_end)
+            offset = self.end + _RECORD.size
+            for part in list(goal_parts) + [solution]:
+                n = len(part)
+                if n > 0:
+                    np.frombuffer(self.mm, dtype='<f8', count=n, offset=offset)[:] = part
+                offset += 8 * n
+
+            # The record only becomes visible to readers once the end offset moves past it
+            self.end = offset
+            self.write_header()
+
+    def close(self):
+        with self.lock:
+            if self.mm is None:
+                return
+            self.mm.flush()
+            self.mm.close()
+            self.mm = None
+            self.file.truncate(self.end)
+            self.file.close()
+
+class SolveLogReader:
+    """
+    Reads a log written by SolveLogWriter. Goals and solutions are returned as
+    NumPy views into the mapping, so they are only valid until close().
+    """
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.num_chain, self.num_joints, self.end = _HEADER.unpack_from(self.mm, 0)
+        assert magic == MAGIC, "{} is not a relaxed_ik solve log".format(path)
+        assert version == VERSION, "Unsupported solve log version {}".format(version)
+
+    def __iter__(self):
+        offset = _HEADER.size
+        while offset < self.end:
+            code, goal_len, solution_len, t_start, t_end = _RECORD.unpack_from(self.mm, offset)
+            offset += _RECORD.size
+            goal = np.frombuffer(self.mm, dtype='<f8', count=goal_len, offset=offset)
+            offset += 8 * goal_len
+            solution = np.frombuffer(self.mm, dtype='<f8', count=solution_len, offset=offset)
+            offset += 8 * solution_len
+            yield KINDS[code], goal, solution, t_start, t_end
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
@@ -0,0 +1,111 @@
+#! /usr/bin/env python3
+
+import rospy
+import threading
+import time
+
+class LatestGoalWorker:
+    """
+    Runs the solver on a dedicated thread. Every goal type has a single-slot
+    mailbox: a goal posted while the previous one of the same type is still
+    waiting replaces it, and the replaced goal is counted as dropped. Goal
+    types with a merge function keep the pending goal's effect instead: the
+    waiting goal becomes merge(pending, new), e.g. summed velocity
+    displacements, and nothing is dropped.
+    Given an executor, the mailboxes are drained by tasks on that shared pool
+    instead, with at most one task per worker in flight.
+    """
+    def __init__(self, handlers, on_solved=None, executor=None, mergers=None):
+        # handlers: goal type -> function(msg) that solves and publishes
+        # mergers: goal type -> function(pending msg, new msg) -> msg to solve
+        self.handlers = handlers
+        self.on_solved = on_solved
+        self.executor = executor
+        self.mergers = mergers if mergers is not None else {}
+        self.slots = dict.fromkeys(handlers)
+        self.dropped = dict.fromkeys(handlers, 0)
+        self.merged = dict.fromkeys(handlers, 0)
+
+        self.cv = threading.Condition()
+        self.running = False
+        self.scheduled = False
+        self.thread = None
+
+    def total_dropped(self):
+        return sum(self.dropped.values())
+
+    def post(self, kind, msg):
+        stamp = time.perf_counter()
+        with self.cv:
+            pending = self.slots[kind]
+            if pending is not None:
+                if kind in self.mergers:
+                    # Keep the pending goal's stamp, so arrival order and latency count from the oldest part
+                    msg = self.mergers[kind](pending[0], msg)
+                    stamp = pending[1]
+                    self.merged[kind] += 1
+                else:
+                    self.dropped[kind] += 1
+            self.slots[kind] = (msg, stamp)
+            if self.executor is None:
+                self.cv.notify()
+            elif self.running and not self.scheduled:
+                self.scheduled = True
+                self.executor.submit(self.drain)
+
+    def start(self):
+        self.running = True
+        if self.executor is not None:
+            return
+        self.thread = threading.Thread(target=self.run, name='relaxed_ik_solver')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        with self.cv:
+            self.running = False
+            self.cv.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+    def pop_oldest(self):
+        # Serve goal types in arrival order so one input cannot starve another
+        kind = None
+        for k, slot in self.slots.items():
+            if slot is not None and (kind is None or slot[1] < self.slots[kind][1]):
+                kind = k
+        if kind is None:
+            return None
+        msg, stamp = self.slots[kind]
+        self.slots[kind] = None
+        return kind, msg, stamp
+
+    def run(self):
+        while True:
+            with self.cv:
+                item = self.pop_oldest()
+                while self.running and item is None:
+                    self.cv.wait()
+                    item = self.pop_oldest()
+                if not self.running:
+                    return
+            self.solve(*item)
+
+    def drain(self):
+        while True:
+            with self.cv:
+                item = self.pop_oldest() if self.running else None
+                if item is None:
+                    self.scheduled = False
+                    return
+            self.solve(*item)
+
+    def solve(self, kind, msg, stamp):
+        try:
+            self.handlers[kind](msg)
+        except Exception as e:
+            rospy.logerr("Solver thread failed on a {} goal: {}".format(kind, e))
+            return
+
+        if self.on_solved is not None:
+            self.on_solved(kind, time.perf_counter() - stamp)
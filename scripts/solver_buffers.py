@@ -0,0 +1,71 @@
+#! /usr/bin/env python3
+
+import ctypes
+import numpy as np
+
+class SolverBuffers:
+    """
+    Persistent NumPy-backed ctypes buffers around a RelaxedIKRust instance.
+    When the wrapper module exposes its ctypes library, pose and velocity goals
+    go to the C API straight from the GoalBuffers memory and the result is
+    copied once into a reused solution array. Otherwise the wrapper methods are
+    called as before. The returned array is overwritten by the next solve.
+    """
+    def __init__(self, relaxed_ik, num_joints, lib=None):
+        self.relaxed_ik = relaxed_ik
+        self.num_joints = num_joints
+
+        if lib is not None and hasattr(lib, 'solve_position') and hasattr(lib, 'solve_velocity'):
+            self.lib = lib
+        else:
+            self.lib = None
+
+        self.joint_state = np.zeros(num_joints)
+        self.joint_state_c = np.ctypeslib.as_ctypes(self.joint_state)
+        self.solution = np.zeros(num_joints)
+        self.solution_addr = self.solution.ctypes.data
+
+    def reset(self, joint_angles):
+        n = len(joint_angles)
+        if n != self.num_joints:
+            x = (ctypes.c_double * n)(*joint_angles)
+            self.relaxed_ik.reset(x, n)
+            return
+
+        self.joint_state[:] = joint_angles
+        self.relaxed_ik.reset(self.joint_state_c, n)
+
+    def solve_position(self, b):
+        if self.lib is None:
+            return self.store(self.relaxed_ik.solve_position(b.positions, b.orientations, b.tolerances))
+
+        xopt = self.lib.solve_position(self.relaxed_ik.obj,
+                                       b.positions_c, len(b.positions),
+                                       b.orientations_c, len(b.orientations),
+                                       b.tolerances_c, len(b.tolerances))
+        return self.store_opt(xopt)
+
+    def solve_velocity(self, b):
+        if self.lib is None:
+            return self.store(self.relaxed_ik.solve_velocity(b.linear_vels, b.angular_vels, b.tolerances))
+
+        xopt = self.lib.solve_velocity(self.relaxed_ik.obj,
+                                       b.linear_vels_c, len(b.linear_vels),
+                                       b.angular_vels_c, len(b.angular_vels),
+                                       b.tolerances_c, len(b.tolerances))
+        return self.store_opt(xopt)
+
+    def hiro_solve_velocity(self, *args):
+        return self.store(self.relaxed_ik.hiro_solve_velocity(*args))
+
+    def store(self, values):
+        assert len(values) == self.num_joints, \
+                "Solver returned {} joints, expected {}".format(len(values), self.num_joints)
+        self.solution[:] = values
+        return self.solution
+
+    def store_opt(self, xopt):
+        assert xopt.length == self.num_joints, \
+                "Solver returned {} joints, expected {}".format(xopt.length, self.num_joints)
+        ctypes.memmove(self.solution_addr, xopt.data, self.num_joints * ctypes.sizeof(ctypes.c_double))
+        return self.solution
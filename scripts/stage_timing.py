@@ -0,0 +1,74 @@
+#! /usr/bin/env python3
+
+import csv
+import numpy as np
+import threading
+import time
+
+from diagnostic_msgs.msg import DiagnosticStatus, KeyValue
+
+class StageTimer:
+    """
+    Wall time per solve stage over a rolling window of the most recent samples.
+    Usage: t = timer.start(); ...; t = timer.record('unpack', t); ...
+    """
+    def __init__(self, stages, window=2000):
+        self.stages = stages
+        self.window = window
+        self.samples = {stage: np.zeros(window) for stage in stages}
+        self.counts = dict.fromkeys(stages, 0)
+        self.lock = threading.Lock()
+
+    def start(self):
+        return time.perf_counter()
+
+    def record(self, stage, start):
+        now = time.perf_counter()
+        with self.lock:
+            self.samples[stage][self.counts[stage] % self.window] = now - start
+            self.counts[stage] += 1
+        return now
+
+    def summary(self):
+        # stage -> (total samples, p50, p95, p99, max) in seconds
+        result = {}
+        with self.lock:
+            for stage in self.stages:
+                n = min(self.counts[stage], self.window)
+                if n == 0:
+                    result[stage] = (0, 0.0, 0.0, 0.0, 0.0)
+                    continue
+                window = self.samples[stage][:n]
+                p50, p95, p99 = np.percentile(window, [50, 95, 99])
+                result[stage] = (self.counts[stage], p50, p95, p99, window.max())
+        return result
+
+    def diagnostic_status(self):
+        statuses = []
+        for stage, (count, p50, p95, p99, max_t) in self.summary().items():
+            status = DiagnosticStatus()
+            status.level = DiagnosticStatus.OK
+            status.name = 'relaxed_ik: {} latency'.format(stage)
+            status.message = 'p99 {:.3f} ms'.format(p99 * 1e3)
+            status.values = [KeyValue('count', str(count)),
+                             KeyValue('p50_ms', '{:.4f}'.format(p50 * 1e3)),
+                             KeyValue('p95_ms', '{:.4f}'.format(p95 * 1e3)),
+                             KeyValue('p99_ms', '{:.4f}'.format(p99 * 1e3)),
+                             KeyValue('max_ms', '{:.4f}'.format(max_t * 1e3))]
+            statuses.append(status)
+        return statuses
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage', 'count', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'])
+            for stage, (count, p50, p95, p99, max_t) in self.summary().items():
+                writer.writerow([stage, count, p50 * 1e3, p95 * 1e3, p99 * 1e3, max_t * 1e3])
+
+class NullStageTimer:
+    """Drop-in StageTimer that records nothing, used when instrumentation is off."""
+    def start(self):
+        return 0.0
+
+    def record(self, stage, start):
+        return 0.0
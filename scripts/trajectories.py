@@ -0,0 +1,27 @@
+#! /usr/bin/env python3
+
+import numpy as np
+
+def square_path(start_positions, num_points=50, side=0.3):
+    """
+    Square in the y-z plane starting at each chain's position: +y, -z, -y, +z,
+    num_points steps per side. start_positions is (num_chain, 3); returns
+    (4 * num_points, num_chain, 3), beginning with the start positions.
+    """
+    delta = side / num_points
+    steps = np.array([[0.0, delta, 0.0], [0.0, 0.0, -delta], [0.0, -delta, 0.0], [0.0, 0.0, delta]])
+    increments = np.repeat(steps, num_points, axis=0)
+    offsets = np.cumsum(increments, axis=0) - increments
+    return np.asarray(start_positions, dtype=float)[None, :, :] + offsets[:, None, :]
+
+def velocity_ramp(num_chain, num_points=200, peak=0.002, direction=(1.0, 0.0, 0.0)):
+    """
+    Linear velocities ramping up and down along direction and then back the
+    other way, so the end effectors return to where they started. Returns
+    (num_points, num_chain, 3).
+    """
+    profile = peak * np.sin(np.linspace(0.0, 2.0 * np.pi, num_points, endpoint=False))
+    direction = np.asarray(direction, dtype=float)
+    direction = direction / np.linalg.norm(direction)
+    vels = profile[:, None] * direction[None, :]
+    return np.repeat(vels[:, None, :], num_chain, axis=1)
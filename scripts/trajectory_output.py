@@ -0,0 +1,200 @@
+#! /usr/bin/env python3
+
+import numpy as np
+import rospy
+
+from trajectory_msgs.msg import JointTrajectory, JointTrajectoryPoint
+
+def articulated_vel_limits(robot):
+    # Joint velocity limits in solver order; joints without one are unlimited
+    limits = []
+    for name in robot.articulated_joint_names:
+        v = robot.joint_vel_limits[robot.all_joint_names.index(name)]
+        limits.append(np.inf if v is None or v <= 0 else v)
+    return np.array(limits, dtype=float)
+
+class Segment:
+    """
+    Cubic move from q0 at velocity v0 to q1 at velocity v1, starting at t0. Its
+    acceleration changes linearly from a0 to a1 over the segment, and its
+    duration T is about the shortest for which no joint exceeds its velocity or
+    acceleration limit, given v0 and v1 within the velocity limits.
+    """
+    def __init__(self, q0, v0, q1, v1, t0, vel_limits, acc_limits, min_duration):
+        self.q0 = q0
+        self.v0 = v0
+        self.q1 = q1
+        self.v1 = v1
+        self.t0 = t0
+
+        T = max(min_duration, 1e-6)
+        if not self.within_limits(T, vel_limits, acc_limits):
+            # Lengthen until the limits hold, then bisect back towards the shortest duration
+            lo = T
+            for _ in range(60):
+                T *= 2.0
+                if self.within_limits(T, vel_limits, acc_limits):
+                    break
+                lo = T
+            for _ in range(20):
+                mid = 0.5 * (lo + T)
+                if self.within_limits(mid, vel_limits, acc_limits):
+                    T = mid
+                else:
+                    lo = mid
+        self.T = T
+        self.t1 = t0 + T
+        self.a0, self.a1 = self.end_accelerations(T)
+
+    def end_accelerations(self, T):
+        d = self.q1 - self.q0
+        a0 = (6.0 * d - (4.0 * self.v0 + 2.0 * self.v1) * T) / (T * T)
+        a1 = (-6.0 * d + (2.0 * self.v0 + 4.0 * self.v1) * T) / (T * T)
+        return a0, a1
+
+    def within_limits(self, T, vel_limits, acc_limits):
+        a0, a1 = self.end_accelerations(T)
+        tolerance = 1.0 + 1e-9
+        if np.any(np.abs(a0) > acc_limits * tolerance) or np.any(np.abs(a1) > acc_limits * tolerance):
+            return False
+        # The velocity peaks where the acceleration crosses zero, if it does
+        crossing = a0 * a1 < 0.0
+        s = np.where(crossing, a0 / np.where(crossing, a0 - a1, 1.0), 0.0)
+        peak = self.v0 + 0.5 * a0 * s * T
+        return bool(np.all(np.abs(peak) <= vel_limits * tolerance))
+
+    def sample(self, t):
+        """Position and velocity at time t."""
+        tau = min(max(t - self.t0, 0.0), self.T)
+        jerk = (self.a1 - self.a0) / self.T
+        position = self.q0 + tau * (self.v0 + tau * (0.5 * self.a0 + tau * jerk / 6.0))
+        velocity = self.v0 + tau * (self.a0 + 0.5 * tau * jerk)
+        return position, velocity
+
+class TrajectoryStreamer:
+    """
+    Turns the stream of solutions into short JointTrajectory segments. Every new
+    solution is queued as a waypoint and the pending waypoints are replanned,
+    after the segment in progress if that one already leads on to another
+    waypoint, else from where and at what velocity the previous plan has the
+    robot at that moment. The motion carries on through the waypoints and only
+    comes to rest at the last one: each waypoint is passed at the slower of the rates the
+    solutions arrived at on either side of it, or at zero where the motion of a
+    joint reverses, so the path does not overshoot. Each Segment is timed so
+    that no joint exceeds its velocity and acceleration limit. At most window
+    waypoints are pending: when the window is full, the newest solution
+    replaces the last one.
+
+    Points are published at the current state and at every waypoint, with
+    positions and velocities taken from the plan. Cubic (position and velocity)
+    interpolation between them reproduces the plan exactly, so accelerations
+    are left empty.
+    """
+    def __init__(self, topic, joint_names, vel_limits, acc_limits, window=5, min_segment_duration=0.01):
+        self.pub = rospy.Publisher(topic, JointTrajectory, queue_size=1)
+        self.joint_names = list(joint_names)
+        self.vel_limits = np.broadcast_to(np.asarray(vel_limits, dtype=float), (len(self.joint_names),))
+        self.acc_limits = np.broadcast_to(np.asarray(acc_limits, dtype=float), (len(self.joint_names),))
+        self.min_segment_duration = min_segment_duration
+        self.window = max(window, 1)
+
+        # (solution, arrival time): the last waypoint passed, then one per segment of the plan
+        self.waypoints = []
+        self.segments = []
+
+    def state(self, now):
+        """Position and velocity the current plan has at time now."""
+        for segment in self.segments:
+            if now < segment.t1:
+                return segment.sample(now)
+        q = self.waypoints[-1][0]
+        return q, np.zeros_like(q)
+
+    def nominal_duration(self, d):
+        # Time of a rest-to-rest move by d at the limits, for solutions that arrived together
+        d = np.abs(d)
+        T = np.maximum(d / self.vel_limits, 2.0 * np.sqrt(d / self.acc_limits))
+        return max(np.max(T), self.min_segment_duration, 1e-6)
+
+    def slope(self, a, b):
+        (qa, ta), (qb, tb) = a, b
+        dt = tb - ta if tb > ta else self.nominal_duration(qb - qa)
+        return (qb - qa) / dt
+
+    def reachable_speed(self, v, d):
+        # Fastest speed after moving by d from speed v along it, at the acceleration limit
+        with np.errstate(invalid='ignore'):
+            return np.sqrt(v * v + np.nan_to_num(2.0 * self.acc_limits * np.abs(d)))
+
+    def update(self, joint_angles, now):
+        q = np.array(joint_angles, dtype=float)
+        if len(self.waypoints) == 0:
+            self.waypoints = [(q, now)]
+            return
+        if np.array_equal(q, self.waypoints[-1][0]):
+            return
+
+        position, velocity = self.state(now)
+        passed = sum(1 for segment in self.segments if segment.t1 <= now)
+        self.waypoints = self.waypoints[passed:]
+        self.segments = self.segments[passed:]
+        if len(self.waypoints) > self.window:
+            self.waypoints[-1] = (q, now)
+        else:
+            self.waypoints.append((q, now))
+
+        if len(self.segments) > 1:
+            # The segment in progress already leads on into the next one: keep it and replan after it
+            current = self.segments[0]
+            self.segments = [current] + self.plan(current.q1, current.v1, current.t1, self.waypoints[1:])
+        else:
+            self.segments = self.plan(position, velocity, now, self.waypoints)
+        self.publish(now)
+
+    def plan(self, position, velocity, t0, waypoints):
+        """Segments from position and velocity at t0 through waypoints[1:], at rest at the last one."""
+        slopes = [self.slope(a, b) for a, b in zip(waypoints[:-1], waypoints[1:])]
+        velocities = [np.clip(velocity, -self.vel_limits, self.vel_limits)]
+        for m0, m1 in zip(slopes[:-1], slopes[1:]):
+            v = np.where(m0 * m1 > 0.0, np.sign(m1) * np.minimum(np.abs(m0), np.abs(m1)), 0.0)
+            velocities.append(np.clip(v, -self.vel_limits, self.vel_limits))
+        velocities.append(np.zeros_like(position))
+
+        # Forward and backward passes: no waypoint is passed faster than the acceleration limit
+        # allows coming from the previous one, or than still lets the motion stop at the last one
+        points = [position] + [q for q, _ in waypoints[1:]]
+        steps = [b - a for a, b in zip(points[:-1], points[1:])]
+        for k in range(1, len(velocities) - 1):
+            reach = self.reachable_speed(np.maximum(velocities[k - 1] * np.sign(steps[k - 1]), 0.0), steps[k - 1])
+            velocities[k] = np.clip(velocities[k], -reach, reach)
+        for k in range(len(velocities) - 2, 0, -1):
+            reach = self.reachable_speed(velocities[k + 1], steps[k])
+            velocities[k] = np.clip(velocities[k], -reach, reach)
+
+        segments = []
+        for k in range(len(points) - 1):
+            segment = Segment(points[k], velocities[k], points[k + 1], velocities[k + 1], t0,
+                              self.vel_limits, self.acc_limits, self.min_segment_duration)
+            segments.append(segment)
+            t0 = segment.t1
+        return segments
+
+    def publish(self, now):
+        msg = JointTrajectory()
+        msg.header.stamp = rospy.Time.from_sec(now)
+        msg.joint_names = self.joint_names
+
+        # Where the plan puts the robot now, then every waypoint still ahead
+        position, velocity = self.state(now)
+        points = [(now, position, velocity)]
+        for segment in self.segments:
+            if segment.t1 > now:
+                points.append((segment.t1, segment.q1, segment.v1))
+
+        for t, position, velocity in points:
+            point = JointTrajectoryPoint()
+            point.positions = position.tolist()
+            point.velocities = velocity.tolist()
+            point.time_from_start = rospy.Duration.from_sec(t - now)
+            msg.points.append(point)
+        self.pub.publish(msg)
@@ -4,9 +4,10 @@ import rospy
 import rospkg
 import actionlib
 from geometry_msgs.msg import Twist
-from relaxed_ik_ros1.msg import EEVelGoals
+from relaxed_ik_ros1.msg import EEVelGoals, HiroVelGoal
 import transformations as T
 from robot import Robot
+from reachability import ReachabilityMap
 from sensor_msgs.msg import Joy
 from std_msgs.msg import Int8MultiArray, Float64MultiArray,  Float32MultiArray
 from franka_msgs.msg import FrankaState
@@ -69,10 +70,11 @@ class GraspLoop:
         self.__pose_order_list = self.set_pose_order_list(flag)
         self.__cur_idx = 0 
         self.already_collided = False
-        self.x_history_list = []
-        self.y_history_list = []
-        self.z_history_list = []
-        self.max_history_len = 50
+        # Ring buffer of end-effector positions, laid out like HiroVelGoal
+        self.max_history_len = HiroVelGoal.HISTORY_CAPACITY
+        self.xyz_history = np.zeros((3, self.max_history_len))
+        self.history_start = 0
+        self.history_len = 0
 
     def set_x_c(self, x_c):
         self.grasp_dict["x_c"] = x_c
@@ -95,16 +97,19 @@ class GraspLoop:
         return difference
     
     def add_to_xyz_history(self, x_ee):
-        self.x_history_list.append(x_ee[0])
-        self.y_history_list.append(x_ee[1])
-        self.z_history_list.append(x_ee[2])
-        if len(self.x_history_list) > self.max_history_len:
-            self.x_history_list.pop(0)
-            self.y_history_list.pop(0)
-            self.z_history_list.pop(0)
+        end = (self.history_start + self.history_len) % self.max_history_len
+        self.xyz_history[:, end] = x_ee[:3]
+        if self.history_len < self.max_history_len:
+            self.history_len += 1
+        else:
+            self.history_start = (self.history_start + 1) % self.max_history_len
 
-    def get_franka_xyz_history(self):
-        return self.x_history_list, self.y_history_list, self.z_history_list
+    def fill_hiro_history(self, msg):
+        msg.history_start = self.history_start
+        msg.history_len = self.history_len
+        msg.x_history = self.xyz_history[0]
+        msg.y_history = self.xyz_history[1]
+        msg.z_history = self.xyz_history[2]
 
     def set_pose_order_list(self, flag):
         self.flag = flag
@@ -226,6 +231,13 @@ class XboxInput:
             setting_file_path = default_setting_file_path
 
         self.robot = Robot(setting_file_path)
+
+        # Grasps from final_grasp that fall outside this map are ignored ('' disables)
+        try:
+            reachability_map_path = rospy.get_param('~reachability_map_path')
+        except:
+            reachability_map_path = ''
+        self.reachability = ReachabilityMap(reachability_map_path) if reachability_map_path != '' else None
         self.grasped = False
         self.final_location = False
         self.made_loop = False
@@ -235,6 +247,7 @@ class XboxInput:
 
         self.ee_vel_goals_pub = rospy.Publisher('relaxed_ik/ee_vel_goals', EEVelGoals, queue_size=1)
         self.hiro_ee_vel_goals_pub = rospy.Publisher('relaxed_ik/hiro_ee_vel_goals', Float64MultiArray, queue_size=1)
+        self.hiro_vel_goal_pub = rospy.Publisher('relaxed_ik/hiro_vel_goal', HiroVelGoal, queue_size=1)
         self.pos_stride = 0.002
         self.rot_stride = 0.0125
         self.p_t = 0.005
@@ -743,34 +756,23 @@ class XboxInput:
 
             line = self.get_unit_line(self.grasp_pose[:3], self.og_x_a[:3])
 
-            hiro_msg = Float64MultiArray()
-            hiro_msg.data = self.get_hiro_error_msg(self.grasp_loop.grasp_dict["x_goal"][3:])
-            self.grasp_loop.add_to_xyz_history(self.fr_position)
-            x_hist, y_hist, z_hist = self.grasp_loop.get_franka_xyz_history()
-            for x in line:
-                hiro_msg.data.append(x)
-            hiro_msg.data.append(self.cone_radius)
-            hiro_msg.data.append(self.cone_height)
-            hiro_msg.data.append(self.msg_obj_to_line)
+            hiro_msg = HiroVelGoal()
+            hiro_msg.header.stamp = rospy.Time.now()
+            error_msg = self.get_hiro_error_msg(self.grasp_loop.grasp_dict["x_goal"][3:])
+            hiro_msg.linear_vel = error_msg[:3]
+            hiro_msg.quat_goal = error_msg[3:7]
+            hiro_msg.quat_line = line
             if self.grasp_loop.check_cone_done():
-                hiro_msg.data.append(0.0)
+                cone_start = 0.0
             else:
-                hiro_msg.data.append(self.msg_cone_start)
-            hiro_msg.data.append(self.og_x_a[0])
-            hiro_msg.data.append(self.og_x_a[1])
-            hiro_msg.data.append(self.og_x_a[2])
-            hiro_msg.data.append(self.grasp_midpoint[0])
-            hiro_msg.data.append(self.grasp_midpoint[1])
-            hiro_msg.data.append(self.grasp_midpoint[2])
-            for x in x_hist:
-                hiro_msg.data.append(x)
-            for y in y_hist:
-                hiro_msg.data.append(y)
-            for z in z_hist:
-                hiro_msg.data.append(z)
-
+                cone_start = self.msg_cone_start
+            hiro_msg.cone_params = [self.cone_radius, self.cone_height, self.msg_obj_to_line, cone_start]
+            hiro_msg.x_a = self.og_x_a[:3]
+            hiro_msg.x_g = self.grasp_midpoint[:3]
+            self.grasp_loop.add_to_xyz_history(self.fr_position)
+            self.grasp_loop.fill_hiro_history(hiro_msg)
 
-            self.hiro_ee_vel_goals_pub.publish(hiro_msg)
+            self.hiro_vel_goal_pub.publish(hiro_msg)
             self.on_release()
             if self.grasp_loop.check_next_state(self.error_state):
                 self.wait_for_new_grasp()
@@ -868,10 +870,14 @@ class XboxInput:
     def subscriber_callback(self, data):
         zero = [0.0, 0.0, 0.0]
         if data.data != zero and not self.grasped:
-            self.grasp_pose = list(data.data)
-            self.grasp_pose[2] = self.grasp_pose[2] -  self.z_offset
-            self.grasp_pose[1] = self.grasp_pose[1] -  self.y_offset
-            self.grasp_pose[0] = self.grasp_pose[0] -  self.x_offset
+            grasp_pose = list(data.data)
+            grasp_pose[2] = grasp_pose[2] -  self.z_offset
+            grasp_pose[1] = grasp_pose[1] -  self.y_offset
+            grasp_pose[0] = grasp_pose[0] -  self.x_offset
+            if self.reachability is not None and not self.reachability.reachable(0, grasp_pose[:3])[0]:
+                rospy.logwarn_throttle(1.0, "Ignoring grasp at {} outside the reachability map".format(grasp_pose[:3]))
+                return
+            self.grasp_pose = grasp_pose
     
     def l_shaped_callback(self, data):
         zero = [0.0, 0.0, 0.0]